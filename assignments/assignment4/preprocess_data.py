@@ -1,32 +1,124 @@
+import os
+import csv
+import json
+import argparse
 import pandas as pd
 
-df = pd.read_csv("data/activities.csv")
+activities_path = "data/activities.csv"
+state_path = "data/preprocess_state.json"
 
-# select the columns I'm interested in
-df = df[["Activity Date", "Activity Type", "Moving Time", 
-         "Distance", "Max Speed", "Average Speed", "Elevation Gain"]]
+# strava writes the dates (in UTC) like "Dec 9, 2024, 12:24:30 AM"
+date_format = "%b %d, %Y, %I:%M:%S %p"
 
-df["Activity Date"] = pd.to_datetime(df["Activity Date"], utc=True)
-df["Activity Date"] = df["Activity Date"].dt.tz_convert('US/Pacific')
-df["Activity Date"] = df["Activity Date"].astype(str) # need it to be str for sketch.js
+# the columns I'm interested in
+columns = ["Activity Date", "Activity Type", "Moving Time",
+           "Distance", "Max Speed", "Average Speed", "Elevation Gain"]
 
-# look at running data only
-df = df[df["Activity Type"] == "Run"]
+# unit conversions, done for all the columns at once: value * multiply / divide
+# sec to min, km to mi (speeds are divided, like the original), m to ft
+multiply = pd.Series({"Moving Time": 1, "Distance": 0.621371, "Max Speed": 1, "Average Speed": 1,
+                      "Elevation Gain": 3.28084})
+divide = pd.Series({"Moving Time": 60, "Distance": 1, "Max Speed": 0.621371, "Average Speed": 0.621371,
+                    "Elevation Gain": 1})
 
-# convert sec to min
-df["Moving Time"] = pd.to_numeric(df["Moving Time"]).divide(60)
+# running data goes where sketch.js reads it from, other activities get their own file
+output_paths = {"Run": "data/activities_cleaned.csv"}
 
-# convert km data to mi 
-df["Distance"] = pd.to_numeric(df["Distance"]).multiply(0.621371)
-df["Max Speed"] = pd.to_numeric(df["Max Speed"]).divide(0.621371)
-df["Average Speed"] = pd.to_numeric(df["Average Speed"]).divide(0.621371)
-df["Speed"] =  df["Distance"] / (df["Moving Time"] / 60)
 
-# m to ft
-df["Elevation Gain"] = pd.to_numeric(df["Elevation Gain"]).multiply(3.28084)
+def output_path(activity_type):
+    return output_paths.get(activity_type, f"data/activities_cleaned_{activity_type.lower().replace(' ', '_')}.csv")
 
-# round to 3 decimal places
-df = df.round(3)
 
-df.to_csv("data/activities_cleaned.csv", index=False)
+def column_positions(path):
+    """
+    The strava export repeats some column names (e.g. a second Distance in meters),
+    so the columns are picked by position: the first column with each name
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        header = next(csv.reader(f))
+    return [header.index(column) for column in columns]
 
+
+def clean_chunk(df):
+    """
+    Convert the dates to pacific time and all the units in one go
+    """
+    try:
+        dates = pd.to_datetime(df["Activity Date"], format=date_format, utc=True)
+    except ValueError:
+        # some other date format, work it out for each date
+        dates = pd.to_datetime(df["Activity Date"], format="mixed", utc=True)
+    df["Activity Date"] = dates.dt.tz_convert('US/Pacific')
+    numbers = list(multiply.index)
+    df[numbers] = df[numbers].mul(multiply).div(divide)
+    df["Speed"] = df["Distance"] / (df["Moving Time"] / 60)
+    return df
+
+
+def load_state():
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path) as f:
+        return json.load(f)
+
+
+def save_state(state):
+    with open(state_path, "w") as f:
+        json.dump(state, f, indent=4)
+
+
+def preprocess(activity_types, incremental=False, chunk_size=10000, path=activities_path):
+    """
+    Read the export in chunks (only the columns above), keeping only the activity types asked for
+    (and with incremental, only activities newer than the last processed one of that type),
+    and write/append each type's cleaned activities to its own file
+    Returns the number of activities written per type
+    """
+    state = load_state() if incremental else {}
+    last_dates = {activity_type: pd.Timestamp(state[activity_type]) for activity_type in activity_types
+                  if activity_type in state and os.path.exists(output_path(activity_type))}
+    # types without an earlier run (or output file) are processed from the start
+    appending = set(last_dates)
+    written = dict.fromkeys(activity_types, 0)
+
+    chunks = pd.read_csv(path, usecols=column_positions(path), chunksize=chunk_size,
+                         dtype={column: float for column in multiply.index})
+    for df in chunks:
+        # filter by type before converting anything
+        df = df.loc[df["Activity Type"].isin(activity_types), columns]
+        if df.empty:
+            continue
+        df = clean_chunk(df)
+
+        for activity_type, rows in df.groupby("Activity Type", sort=False):
+            if activity_type in last_dates:
+                rows = rows[rows["Activity Date"] > last_dates[activity_type]]
+            if rows.empty:
+                continue
+            newest = rows["Activity Date"].max()
+            if activity_type not in state or newest > pd.Timestamp(state[activity_type]):
+                state[activity_type] = newest.isoformat()
+
+            rows = rows.assign(**{"Activity Date": rows["Activity Date"].astype(str)}) # need it to be str for sketch.js
+            # round to 3 decimal places
+            rows = rows.round(3)
+            header = activity_type not in appending and written[activity_type] == 0
+            rows.to_csv(output_path(activity_type), mode="w" if header else "a", header=header, index=False)
+            written[activity_type] += len(rows)
+
+    save_state(state)
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Clean the strava activities export, one file per activity type")
+    parser.add_argument("--types", nargs="+", default=["Run", "Ride", "Swim"],
+                        help="activity types to keep (running data goes to data/activities_cleaned.csv)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only add the activities newer than the last run to the cleaned files")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="rows of the export to read at a time")
+    args = parser.parse_args()
+
+    written = preprocess(args.types, incremental=args.incremental, chunk_size=args.chunk_size)
+    for activity_type, count in written.items():
+        print(f"{activity_type}: {count} activities written to {output_path(activity_type)}")
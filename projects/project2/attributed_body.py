@@ -0,0 +1,149 @@
+r"""
+Recovers the text of messages that only have it in the attributedBody column
+(newer versions of macOS often leave message.text NULL and keep the text in this typedstream blob)
+
+An attributedBody is an NSAttributedString archived with NeXTSTEP's typedstream format:
+
+    \x04\x0bstreamtyped ... NSAttributedString ... NSString \x01\x94\x84\x01 + <length> <utf-8 text> \x86 ...
+
+so the text is the string right after the NSString class name and its "+" type marker. The length is a
+typedstream integer: one byte, or \x81 and 2 bytes / \x82 and 4 bytes (little endian) for longer texts
+
+The blobs are decoded in batches across a process pool, see BodyDecoder
+Run from projects/project2 to decode every blob of a database and see the throughput:
+python3 attributed_body.py --chat-db path/to/chat.db --workers 4
+"""
+
+import os
+import re
+import time
+import sqlite3
+import argparse
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor
+
+# (not imported from parallel.py, the worker processes would have to import the nlp libraries too)
+default_workers = os.cpu_count() or 1
+
+string_pattern = re.compile(rb"NSString.{0,8}?\x84\x01\+", flags=re.DOTALL)
+# attachments sit in the text as U+FFFC (object replacement character)
+attachment_char = "\ufffc"
+
+
+def decode_attributed_body(blob):
+    """
+    The plain text of one attributedBody blob ("" when it only holds attachments)
+    Raises ValueError when the blob can't be decoded
+    """
+    if blob is None:
+        raise ValueError("no attributedBody")
+    blob = bytes(blob)
+    match = string_pattern.search(blob)
+    if match is None:
+        raise ValueError("no NSString in attributedBody")
+    start = match.end()
+    if start >= len(blob):
+        raise ValueError("attributedBody ends before the text")
+
+    length = blob[start]
+    if length == 0x81:
+        length, start = int.from_bytes(blob[start + 1:start + 3], "little"), start + 3
+    elif length == 0x82:
+        length, start = int.from_bytes(blob[start + 1:start + 5], "little"), start + 5
+    else:
+        start += 1
+    if start + length > len(blob):
+        raise ValueError("attributedBody text is cut off")
+    # strict utf-8, a bad decode means the length (or the blob) is wrong
+    text = blob[start:start + length].decode("utf-8")
+    return text.replace(attachment_char, "").strip()
+
+
+def decode_batch(blobs):
+    """
+    Worker: decode a list of blobs, returns (texts with None for failures and empty texts, number that failed)
+    """
+    texts, failed = [], 0
+    for blob in blobs:
+        try:
+            texts.append(decode_attributed_body(blob) or None)
+        except (ValueError, UnicodeDecodeError):
+            texts.append(None)
+            failed += 1
+    return texts, failed
+
+
+class BodyDecoder:
+    """
+    Decodes series of blobs with a pool of worker processes (workers=1 decodes in this process)
+    and keeps count of how many blobs were decoded/empty/failed and how long it took
+    The pool is only started once there's more than one batch to decode, small archives don't pay for it
+    """
+
+    def __init__(self, workers=default_workers, batch_size=2000):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.blobs = self.decoded = self.empty = self.failed = self.bytes = 0
+        self.seconds = 0.0
+        self._pool = None
+
+    def decode(self, blobs):
+        """
+        Decode a series of blobs, returns a series of texts with the same index (None where there is no text)
+        """
+        started = time.perf_counter()
+        values = list(blobs)
+        batches = [values[i:i + self.batch_size] for i in range(0, len(values), self.batch_size)]
+        if self._pool is None and self.workers > 1 and len(batches) > 1:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        results = self._pool.map(decode_batch, batches) if self._pool is not None else map(decode_batch, batches)
+        texts = []
+        for batch_texts, failed in results:
+            texts.extend(batch_texts)
+            self.failed += failed
+        texts = pd.Series(texts, index=blobs.index, dtype=object)
+
+        self.seconds += time.perf_counter() - started
+        self.blobs += len(values)
+        self.bytes += sum(len(blob) for blob in values if blob is not None)
+        self.decoded += int(texts.notna().sum())
+        self.empty = self.blobs - self.decoded - self.failed
+        return texts
+
+    def report(self):
+        rate = self.blobs / self.seconds if self.seconds else 0
+        print(f"[attributedBody] {self.blobs} blobs: {self.decoded} decoded, {self.empty} empty (attachments only), "
+              f"{self.failed} failed, {rate:,.0f} blobs/s ({self.bytes / 1024 ** 2 / (self.seconds or 1):.1f} MB/s) "
+              f"with {self.workers} worker(s)")
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decode the attributedBody of every message without text")
+    parser.add_argument("--chat-db", required=True, help="path to the Messages chat.db file")
+    parser.add_argument("--workers", type=int, default=default_workers, help="decoding processes")
+    parser.add_argument("--chunk-size", type=int, default=50000, help="number of blobs to read from sqlite at a time")
+    parser.add_argument("--batch-size", type=int, default=2000, help="number of blobs sent to a worker at a time")
+    parser.add_argument("--all", action="store_true", help="decode every blob, not just the messages without text")
+    args = parser.parse_args()
+
+    query = "select ROWID, attributedBody from message where attributedBody is not null"
+    if not args.all:
+        query += " and text is null"
+    conn = sqlite3.connect(f"file:{args.chat_db}?mode=ro", uri=True)
+    with BodyDecoder(args.workers, args.batch_size) as decoder:
+        for chunk in pd.read_sql_query(query, conn, chunksize=args.chunk_size):
+            decoder.decode(chunk["attributedBody"])
+        decoder.report()
+    conn.close()
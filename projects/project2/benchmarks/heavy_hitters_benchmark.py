@@ -0,0 +1,102 @@
+"""
+Compares most_common_words(texts, get_all=True, capacity=...), the top 100 words counted approximately
+(SpaceSaving, heavy_hitters.py), against the exact most_common_words(texts, get_all=True) on a synthetic
+corpus of stop words, common words and a long tail of typos: time, memory, how many of the true top 100
+are found and how far off their counts are (against the N / capacity error bound)
+
+Run from projects/project2: python3 benchmarks/heavy_hitters_benchmark.py --messages 200000
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import most_common_words, count_words, kept_words, skipped_words, get_stop_words
+
+vocab = ["lol", "ok", "okay", "yeah", "dinner", "tonight", "gonna", "wanna", "movie", "pizza", "coffee", "class",
+         "party", "tomorrow", "hello", "sure", "haha", "the", "and", "you", "to", "what", "omg", "love", "work",
+         "home", "later", "soon", "game", "text", "call", "food", "sleep", "tired", "happy", "birthday", "weekend"]
+letters = "abcdefghijklmnopqrstuvwxyz"
+
+
+def make_typo(rng, word):
+    i = rng.randrange(len(word))
+    return word[:i] + rng.choice(letters) + word[i + 1:] + rng.choice(letters) * rng.randint(0, 3)
+
+
+def make_corpus(n_messages, typo_rate=0.1, seed=0):
+    """
+    Messages of zipf distributed words, the stop words being the most common (like in real texts), then the vocab
+    and rare made up words, with typo_rate of the words misspelled
+    """
+    rng = random.Random(seed)
+    stop_words = sorted(word for word in get_stop_words() if word.isalpha())
+    rng.shuffle(stop_words)
+    words = stop_words + vocab + [f"{rng.choice(vocab)}{i}" for i in range(5000)]
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    texts = []
+    for _ in range(n_messages):
+        message = rng.choices(words, weights, k=rng.randint(1, 12))
+        texts.append(" ".join(make_typo(rng, w) if rng.random() < typo_rate else w for w in message))
+    return texts
+
+
+def measure(func):
+    """
+    Run func, returns (result, seconds, peak memory allocated while it ran in MB)
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def accuracy(exact, approximate):
+    """
+    Share of the true top words found in the approximate top, and the largest count error among the true top
+    (words tied with the last one of the true top can be left out either way, they aren't counted)
+    """
+    found = dict(approximate)
+    true_top = [(word, count) for word, count in exact if count > exact[-1][1]]
+    recall = sum(word in found for word, _ in true_top) / len(true_top)
+    max_error = max(abs(found.get(word, 0) - count) for word, count in true_top)
+    return recall, max_error
+
+
+def main(n_messages, capacities, typo_rate=0.1):
+    texts = make_corpus(n_messages, typo_rate)
+    exact, exact_seconds, exact_peak = measure(lambda: most_common_words(texts, get_all=True))
+    # N in the error bound: only the words that aren't skipped go into the summary
+    counted = kept_words(count_words(texts), skipped_words())
+    total = sum(counted.values())
+    print(f"{n_messages} synthetic messages, {total:,} words counted ({len(counted):,} distinct) "
+          f"after leaving out the stop words")
+    print(f"\n{'counts':18s} {'words':>6s} {'peak MB':>8s} {'seconds':>8s} {'top ' + str(len(exact)):>8s} "
+          f"{'max err':>8s} {'bound':>8s}")
+    print(f"{'exact':18s} {len(exact):6d} {exact_peak:8.1f} {exact_seconds:8.3f} {1:8.0%} {0:8d}")
+
+    for capacity in capacities:
+        approximate, seconds, peak = measure(lambda: most_common_words(texts, get_all=True, capacity=capacity))
+        recall, max_error = accuracy(exact, approximate or [])
+        print(f"{'capacity ' + str(capacity):18s} {len(approximate or []):6d} {peak:8.1f} {seconds:8.3f} "
+              f"{recall:8.0%} {max_error:8,d} {total / capacity:8,.0f}")
+    print(f"\nwords: how many top words were returned, peak MB: most memory allocated while counting, "
+          f"top {len(exact)}: share of the true top words found, max err: largest count error among them, "
+          f"bound: N / capacity")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark most_common_words with approximate vs exact counts")
+    parser.add_argument("--messages", type=int, default=200000, help="number of synthetic messages")
+    parser.add_argument("--capacities", type=int, nargs="+", default=[200, 1000, 5000],
+                        help="capacities (distinct words kept) to try")
+    parser.add_argument("--typo-rate", type=float, default=0.1, help="share of the words that are misspelled")
+    args = parser.parse_args()
+    main(args.messages, args.capacities, args.typo_rate)
@@ -0,0 +1,90 @@
+"""
+Compares counting words/emoji by tokenizing every message against interning (interning.py), where each
+distinct message is tokenized once and its counts are weighted by how many times it was sent,
+on synthetic corpora where a share of the messages are repeats of common ones ("lol", "ok", links, ...)
+
+Run from projects/project2: python3 benchmarks/interning_benchmark.py --messages 200000
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import tokenize_text, emoji_pattern, count_words, count_emoji, text_interner
+
+vocab = ["lol", "ok", "okay", "yeah", "dinner", "tonight", "gonna", "wanna", "don't", "it's", "I'm", "movie",
+         "pizza", "coffee", "class", "party", "tomorrow", "hello!", "what?", "sure.", "haha", "😂", "😭", "❤️",
+         "🔥", "👍", "🎉", "https://youtu.be/abc123", "https://open.spotify.com/track/xyz?si=1"]
+
+
+def make_corpus(n_messages, repeat_rate, n_common=500, seed=0):
+    """
+    repeat_rate of the messages are one of n_common messages (zipf distributed), the rest are random
+    """
+    rng = random.Random(seed)
+    common = [" ".join(rng.choice(vocab) for _ in range(rng.randint(1, 4))) for _ in range(n_common)]
+    weights = [1 / (rank + 1) for rank in range(n_common)]
+    return [rng.choices(common, weights)[0] if rng.random() < repeat_rate
+            else " ".join(rng.choice(vocab) for _ in range(rng.randint(1, 15))) for _ in range(n_messages)]
+
+
+# counting every message, like utils.py did before interning
+def every_message_counts(texts):
+    return Counter(tokenize_text(' '.join(texts))), Counter(emoji_pattern.findall(''.join(texts)))
+
+
+def interned_counts(texts):
+    return count_words(texts), count_emoji(texts)
+
+
+def time_it(func, texts):
+    start = time.perf_counter()
+    result = func(texts)
+    return time.perf_counter() - start, result
+
+
+def main(n_messages, repeat_rates):
+    print(f"{n_messages} synthetic messages, counted in two halves (the second half can use the cache)")
+    print(f"\n{'repeats':>8s} {'dedup':>6s} {'every msg s':>12s} {'interned s':>11s} {'2nd half s':>11s} "
+          f"{'speedup':>8s} {'same':>5s}")
+    for repeat_rate in repeat_rates:
+        texts = make_corpus(n_messages, repeat_rate)
+        halves = [texts[:n_messages // 2], texts[n_messages // 2:]]
+
+        every_seconds, expected = 0.0, []
+        for half in halves:
+            seconds, counts = time_it(every_message_counts, half)
+            every_seconds += seconds
+            expected.append(counts)
+
+        text_interner.clear()
+        before = text_interner.snapshot()
+        interned_seconds, results = [], []
+        for half in halves:
+            seconds, counts = time_it(interned_counts, half)
+            interned_seconds.append(seconds)
+            results.append(counts)
+        stats = text_interner.since(before)
+
+        # same counts in the same order (ties keep the order of first appearance)
+        same = all(list(r.items()) == list(e.items()) for result, exp in zip(results, expected)
+                   for r, e in zip(result, exp))
+        dedup = stats["texts"] / stats["unique"]
+        print(f"{repeat_rate:8.0%} {dedup:5.1f}x {every_seconds:12.3f} {sum(interned_seconds):11.3f} "
+              f"{interned_seconds[1]:11.3f} {every_seconds / sum(interned_seconds):7.1f}x {str(same):>5s}")
+    print("\nrepeats: share of messages that are a common message, dedup: messages per distinct message, "
+          "2nd half s: time for the second half of the interned counting")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark word/emoji counting with and without interning")
+    parser.add_argument("--messages", type=int, default=200000, help="number of synthetic messages")
+    parser.add_argument("--repeat-rates", type=float, nargs="+", default=[0, 0.25, 0.5, 0.75],
+                        help="shares of the messages that repeat a common message")
+    args = parser.parse_args()
+    main(args.messages, args.repeat_rates)
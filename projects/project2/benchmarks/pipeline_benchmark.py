@@ -0,0 +1,195 @@
+"""
+Times each stage of the pipeline on a synthetic archive (see synthetic_data.py):
+extract (get_parse_data.py), merge (load and resolve contacts), tokenize, group (per-day cube and roll up),
+link extraction and the JSON write, reporting throughput (rows/sec) and the peak memory each stage allocated
+(tracemalloc, measured in one more run of the pipeline so it doesn't slow down the timed runs; memory allocated
+by the worker processes with --workers isn't included)
+Results can be saved as a baseline, later runs flag stages that got slower or use more memory than it
+
+Run from projects/project2:
+    python3 benchmarks/pipeline_benchmark.py --messages 200000 --save-baseline
+    python3 benchmarks/pipeline_benchmark.py --messages 200000
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+from contextlib import redirect_stdout
+
+project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_dir)
+sys.path.insert(0, os.path.join(project_dir, "benchmarks"))
+
+import get_parse_data
+import prepare_data
+
+from synthetic_data import make_archive
+from storage import default_format, FORMATS
+from utils import tokenize_texts, emoji_pattern, text_interner
+from cube import build_cube, rollup
+from links import extract_links, link_interner
+from contacts import contact_index_path
+
+baseline_path = os.path.join(project_dir, "benchmarks", "pipeline_baseline.json")
+stages = ["extract", "merge", "tokenize", "group", "links", "json"]
+
+
+def run_pipeline(chat_db, contacts_db, fmt, workers, shard_by, verbose=False, trace_memory=False):
+    """
+    Run every stage once (in the current directory), returns {stage: {"seconds", "rows"}}
+    With trace_memory, also the peak memory allocated during each stage on its own ("peak_mb"),
+    not counting what earlier stages still hold (tracing makes the stages slower)
+    """
+    results = {}
+    state = {}
+    # start like a fresh run, not with the texts interned or the contact index built by the run before
+    text_interner.clear()
+    link_interner.clear()
+    if os.path.exists(contact_index_path):
+        os.remove(contact_index_path)
+
+    def extract():
+        get_parse_data.main(chat_db=chat_db, contacts_db=contacts_db, fmt=fmt, decode_workers=workers)
+        return get_parse_data.load_ingest_state(fmt)["last_rowid"]
+
+    def merge():
+        state["df"] = prepare_data.load_messages(fmt)
+        return len(state["df"])
+
+    def tokenize():
+        texts = state["df"]["text"]
+        tokenize_texts(texts)
+        texts.astype(object).str.findall(emoji_pattern)
+        return len(texts)
+
+    def group():
+        state["groups"] = rollup(build_cube(state["df"], workers, shard_by), prepare_data.group_keys)
+        return len(state["df"])
+
+    def links():
+        sent = state["df"][state["df"]["is_from_me"] == 1]
+        extract_links(sent["text"])
+        return len(sent)
+
+    def write_json():
+        prepare_data.write_text_counts(state["groups"])
+        prepare_data.write_text_counts(state["groups"], remove_common_words=True)
+        return len(state["groups"])
+
+    for stage, func in zip(stages, [extract, merge, tokenize, group, links, write_json]):
+        output = sys.stdout if verbose else io.StringIO()
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        with redirect_stdout(output):
+            rows = func()
+        seconds = time.perf_counter() - start
+        results[stage] = {"seconds": seconds, "rows": int(rows)}
+        if trace_memory:
+            results[stage]["peak_mb"] = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+            tracemalloc.stop()
+    return results
+
+
+def best_of(runs, memory):
+    # fastest time for each stage over the runs (rows are the same every run), with its peak memory from memory
+    best = {stage: min((run[stage] for run in runs), key=lambda result: result["seconds"]) for stage in stages}
+    return {stage: {**result, "peak_mb": memory[stage]["peak_mb"]} for stage, result in best.items()}
+
+
+def throughput(result):
+    return result["rows"] / result["seconds"] if result["seconds"] else float("inf")
+
+
+def find_regressions(report, baseline, tolerance):
+    """
+    Stages whose throughput dropped, or whose peak memory grew, by more than tolerance (a fraction) vs the baseline
+    """
+    regressions = []
+    for stage, result in report["stages"].items():
+        base = baseline["stages"].get(stage)
+        if base is None:
+            continue
+        if throughput(result) < throughput(base) * (1 - tolerance):
+            regressions.append(f"{stage}: {throughput(result):,.0f} rows/sec vs {throughput(base):,.0f} in the baseline")
+        # baselines saved before memory was measured per stage only have the process peak, which isn't comparable
+        if "peak_mb" in base and result["peak_mb"] > base["peak_mb"] * (1 + tolerance):
+            regressions.append(f"{stage}: peak memory {result['peak_mb']:.0f} MB vs {base['peak_mb']:.0f} MB in the baseline")
+    return regressions
+
+
+def print_report(report, baseline=None):
+    print(f"{report['messages']} messages, {report['contacts']} contacts, format {report['format']}, "
+          f"{report['workers']} worker(s)")
+    print(f"{'stage':10s} {'seconds':>9s} {'rows':>10s} {'rows/sec':>12s} {'peak MB':>9s} {'vs baseline':>12s}")
+    for stage, result in report["stages"].items():
+        change = ""
+        if baseline is not None and stage in baseline["stages"]:
+            change = f"{throughput(result) / throughput(baseline['stages'][stage]) - 1:+.0%}"
+        print(f"{stage:10s} {result['seconds']:9.3f} {result['rows']:10d} {throughput(result):12,.0f} "
+              f"{result['peak_mb']:9.1f} {change:>12s}")
+
+
+def main(n_messages, n_contacts, fmt=default_format, workers=1, shard_by="year", repeat=1, seed=0,
+         workdir=None, save_baseline=False, tolerance=0.2, verbose=False):
+    workdir = workdir or tempfile.mkdtemp(prefix="pipeline_benchmark_")
+    chat_db, contacts_db = make_archive(workdir, n_messages, n_contacts, seed)
+    os.makedirs(os.path.join(workdir, "data"), exist_ok=True)
+
+    # the scripts read and write data/ relative to the working directory
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        runs = [run_pipeline(chat_db, contacts_db, fmt, workers, shard_by, verbose) for _ in range(repeat)]
+        memory = run_pipeline(chat_db, contacts_db, fmt, workers, shard_by, verbose, trace_memory=True)
+    finally:
+        os.chdir(cwd)
+
+    report = {"messages": n_messages, "contacts": n_contacts, "format": fmt, "workers": workers,
+              "stages": best_of(runs, memory)}
+    baseline = None
+    if not save_baseline and os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        if (baseline["messages"], baseline["format"], baseline["workers"]) != (n_messages, fmt, workers):
+            print(f"Baseline is for {baseline['messages']} messages ({baseline['format']}, {baseline['workers']} "
+                  f"worker(s)), not comparing")
+            baseline = None
+    print_report(report, baseline)
+
+    if save_baseline:
+        with open(baseline_path, "w") as f:
+            json.dump(report, f, indent=4)
+        print(f"Saved the baseline to {baseline_path}")
+        return []
+
+    regressions = find_regressions(report, baseline, tolerance) if baseline is not None else []
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark each stage of the pipeline on a synthetic archive")
+    parser.add_argument("--messages", type=int, default=100000, help="number of synthetic messages")
+    parser.add_argument("--contacts", type=int, default=200, help="number of synthetic contacts")
+    parser.add_argument("--format", choices=FORMATS, default=default_format, help="format of the intermediate tables")
+    parser.add_argument("--workers", type=int, default=1, help="processes used to count words/emoji")
+    parser.add_argument("--shard-by", choices=["year", "chat"], default="year")
+    parser.add_argument("--repeat", type=int, default=1, help="runs of the pipeline (the best time of each stage is reported)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="directory for the synthetic databases and data/ (a temporary one by default)")
+    parser.add_argument("--save-baseline", action="store_true", help=f"save the results as the baseline ({baseline_path})")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="flag stages more than this fraction slower (or using more memory) than the baseline")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the pipeline scripts")
+    args = parser.parse_args()
+    regressions = main(args.messages, args.contacts, args.format, args.workers, args.shard_by, args.repeat, args.seed,
+                       args.workdir, args.save_baseline, args.tolerance, args.verbose)
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,192 @@
+"""
+Generates synthetic Messages (chat.db) and AddressBook (.abcddb) sqlite files with the tables and columns
+get_parse_data.py reads, so the pipeline can be run and benchmarked without a real archive
+
+Run from projects/project2: python3 benchmarks/synthetic_data.py --messages 100000 --contacts 200 --out /tmp/synthetic
+"""
+
+import os
+import random
+import sqlite3
+import argparse
+
+# seconds between the unix epoch and apple's (2001-01-01), message dates are nanoseconds since the latter
+apple_epoch_offset = 978307200
+
+first_names = ["Alex", "Sam", "Jordan", "Taylor", "Morgan", "Casey", "Riley", "Jamie", "Avery", "Quinn",
+               "Mary-Kate", "Jean-Luc", "Ana", "Wei", "Priya", "Mateo", "Noor", "Kai", "Lena", "Omar"]
+last_names = ["Smith", "Nguyen", "Garcia", "Kim", "Patel", "Brown", "Lopez", "Chen", "", "O'Neil"]
+
+words = ["lol", "ok", "okay", "yeah", "dinner", "tonight", "gonna", "wanna", "cannot", "gotta", "lemme",
+         "don't", "it's", "I'm", "you're", "can't", "movie", "pizza", "coffee", "class", "party", "tomorrow",
+         "hello!", "what?", "sure.", "re-do", "café", "100%", "so...", "haha", "the", "and", "you", "to",
+         "😂", "😭", "❤️", "🔥", "👍", "🎉"]
+links = ["https://youtu.be/{id}", "https://www.youtube.com/watch?v={id}", "https://open.spotify.com/track/{id}?si=1",
+         "https://open.spotify.com/playlist/{id}", "https://www.instagram.com/p/{id}/", "https://github.com/{id}",
+         "https://en.wikipedia.org/wiki/{id}"]
+reactions = ["Loved", "Liked", "Laughed at", "Emphasized"]
+
+chat_schema = """
+create table message (ROWID integer primary key autoincrement, guid text, text text, handle_id integer,
+                      date integer, is_from_me integer, is_emote integer, is_audio_message integer,
+                      attributedBody blob);
+create table handle (ROWID integer primary key autoincrement, id text, service text);
+create table chat (ROWID integer primary key autoincrement, guid text);
+create table chat_message_join (chat_id integer, message_id integer, message_date integer);
+"""
+
+address_book_schema = """
+create table ZABCDRECORD (Z_PK integer primary key, ZFIRSTNAME text, ZLASTNAME text);
+create table ZABCDPHONENUMBER (Z_PK integer primary key, ZOWNER integer, ZFULLNUMBER text, ZLASTFOURDIGITS text);
+create table ZABCDEMAILADDRESS (Z_PK integer primary key, ZOWNER integer, ZADDRESS text);
+"""
+
+
+def format_number(rng, digits):
+    # the address book keeps numbers however they were typed in
+    area, prefix, line = digits[:3], digits[3:6], digits[6:]
+    return rng.choice([f"({area}) {prefix}-{line}", f"+1 ({area}) {prefix}-{line}",
+                       f"{area}.{prefix}.{line}", f"+1{digits}"])
+
+
+def make_address_book(path, n_contacts, seed=0):
+    """
+    Write an AddressBook database with n_contacts people, returns their handles (E.164 number or email)
+    """
+    rng = random.Random(seed)
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.executescript(address_book_schema)
+
+    records, numbers, emails, handles = [], [], [], []
+    for pk in range(1, n_contacts + 1):
+        first, last = rng.choice(first_names), rng.choice(last_names)
+        records.append((pk, first, last or None))
+        digits = f"{rng.randint(200, 999)}{rng.randint(200, 999)}{pk % 10000:04d}"
+        numbers.append((pk, pk, format_number(rng, digits), digits[-4:]))
+        handles.append(f"+1{digits}")
+        if rng.random() < 0.2:
+            email = f"{first}.{last or pk}{pk}@example.com".lower().replace("'", "")
+            # emails in the address book aren't always lowercase like the message handles
+            emails.append((pk, pk, email.capitalize()))
+            handles.append(email)
+
+    conn.executemany("insert into ZABCDRECORD values (?, ?, ?)", records)
+    conn.executemany("insert into ZABCDPHONENUMBER values (?, ?, ?, ?)", numbers)
+    conn.executemany("insert into ZABCDEMAILADDRESS values (?, ?, ?)", emails)
+    conn.commit()
+    conn.close()
+    return handles
+
+
+def make_text(rng):
+    text = " ".join(rng.choice(words) for _ in range(rng.randint(1, 15)))
+    roll = rng.random()
+    if roll < 0.05:
+        text += " " + rng.choice(links).format(id=rng.randint(1, 500))
+    elif roll < 0.08:
+        text = f"{rng.choice(reactions)} “{text}”"
+    return text
+
+
+def typedstream_length(n):
+    # typedstream integers: one byte, or \x81 + 2 bytes / \x82 + 4 bytes
+    if n < 0x80:
+        return bytes([n])
+    if n < 0x8000:
+        return b"\x81" + n.to_bytes(2, "little")
+    return b"\x82" + n.to_bytes(4, "little")
+
+
+def encode_attributed_body(text, mutable=False):
+    """
+    An attributedBody blob (typedstream archived NSAttributedString) holding text, like the ones macOS writes
+    """
+    data = text.encode("utf-8")
+    header = (b"\x04\x0bstreamtyped\x81\xe8\x03\x84\x01@"
+              b"\x84\x84\x84\x12NSAttributedString\x00\x84\x84\x08NSObject\x00\x85\x92")
+    string_class = b"\x84\x84\x84\x08NSString"
+    if mutable:
+        string_class = b"\x84\x84\x84\x0fNSMutableString\x00\x84\x84\x08NSString"
+    # the attributes: one run covering the whole text with an empty dictionary
+    attributes = (b"\x84\x02iI\x01" + typedstream_length(len(text))
+                  + b"\x92\x84\x84\x84\x0cNSDictionary\x00\x94\x84\x01i\x00\x86")
+    return (header + string_class + b"\x01\x94\x84\x01+" + typedstream_length(len(data)) + data + b"\x86"
+            + attributes + b"\x86")
+
+
+def make_chat_db(path, n_messages, handles, seed=0, start_year=2018, end_year=2025, chunk_size=50000,
+                 body_only_fraction=0.0):
+    """
+    Write a Messages database with n_messages between the given handles (plus some unknown numbers)
+    in date order like a real archive, about 5% of the messages have no text (attachments etc)
+    body_only_fraction of those have their text only in attributedBody, like on newer versions of macOS
+    (a few of them only hold an attachment or are corrupted, so nothing can be recovered)
+    """
+    rng = random.Random(seed)
+    # separate random numbers for the bodies, so the rest of the archive is the same for any body_only_fraction
+    body_rng = random.Random(seed + 1)
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.executescript(chat_schema)
+
+    unknown = [f"+1{rng.randint(2000000000, 9999999999)}" for _ in range(max(1, len(handles) // 10))] + ["12345"]
+    all_handles = handles + unknown
+    conn.executemany("insert into handle (id, service) values (?, 'iMessage')", [(h,) for h in all_handles])
+    conn.executemany("insert into chat (guid) values (?)", [(f"chat{i}",) for i in range(len(all_handles))])
+
+    start = (start_year - 2001) * 365.25 * 86400
+    end = (end_year + 1 - 2001) * 365.25 * 86400
+    step = (end - start) / max(n_messages, 1)
+    rowid = 0
+    while rowid < n_messages:
+        messages, joins = [], []
+        for rowid in range(rowid + 1, min(rowid + chunk_size, n_messages) + 1):
+            handle_id = rng.randint(1, len(all_handles))
+            date = int((start + rowid * step + rng.random() * step) * 10 ** 9)
+            text = None if rng.random() < 0.05 else make_text(rng)
+            body = b"\x04\x0bstreamtyped"
+            if text is None:
+                # an attachment without a caption
+                body = encode_attributed_body("\ufffc")
+            if text is None and body_rng.random() < body_only_fraction:
+                roll = body_rng.random()
+                if roll < 0.9:
+                    body = encode_attributed_body(make_text(body_rng), mutable=body_rng.random() < 0.3)
+                elif roll < 0.97:
+                    body = encode_attributed_body("\ufffc")
+                else:
+                    body = encode_attributed_body(make_text(body_rng))[:-40]
+            messages.append((rowid, f"guid{rowid}", text, handle_id, date, rng.randint(0, 1),
+                             int(rng.random() < 0.01), int(rng.random() < 0.01), body))
+            joins.append((handle_id, rowid, date))
+        conn.executemany("insert into message values (?, ?, ?, ?, ?, ?, ?, ?, ?)", messages)
+        conn.executemany("insert into chat_message_join values (?, ?, ?)", joins)
+    conn.commit()
+    conn.close()
+
+
+def make_archive(out_dir, n_messages, n_contacts, seed=0, body_only_fraction=0.0):
+    """
+    Generate both databases in out_dir, returns (chat_db, contacts_db) paths
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    chat_db = os.path.join(out_dir, "chat.db")
+    contacts_db = os.path.join(out_dir, "AddressBook-v22.abcddb")
+    handles = make_address_book(contacts_db, n_contacts, seed)
+    make_chat_db(chat_db, n_messages, handles, seed, body_only_fraction=body_only_fraction)
+    return chat_db, contacts_db
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic chat.db and AddressBook database")
+    parser.add_argument("--messages", type=int, default=100000, help="number of messages")
+    parser.add_argument("--contacts", type=int, default=200, help="number of contacts")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="synthetic", help="directory to write chat.db and the AddressBook file to")
+    parser.add_argument("--body-only", type=float, default=0.0,
+                        help="fraction of the messages without text that have it in attributedBody instead")
+    args = parser.parse_args()
+    print(make_archive(args.out, args.messages, args.contacts, args.seed, body_only_fraction=args.body_only))
@@ -0,0 +1,107 @@
+"""
+Compares the throughput (messages/sec) of the word/emoji counting in utils.py against
+the original nltk word_tokenize implementation, on a synthetic corpus of text messages
+
+Run from projects/project2: python3 benchmarks/tokenize_benchmark.py --messages 100000
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import get_stop_words, most_common_words, most_common_emoji, tokenize_texts
+
+vocab = ["lol", "ok", "okay", "yeah", "dinner", "tonight", "gonna", "wanna", "cannot", "gotta", "lemme",
+         "don't", "it's", "I'm", "you're", "can't", "movie", "pizza", "coffee", "class", "party", "tomorrow",
+         "hello!", "what?", "sure.", "e.g.", "re-do", "café", "naïve", "100%", "#1", "@home", "so...", "haha",
+         "😂", "😭", "❤️", "🔥", "👍", "🎉", "https://youtu.be/abc123", "https://open.spotify.com/track/xyz?si=1"]
+
+
+def make_corpus(n_messages, seed=0):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(vocab) for _ in range(rng.randint(1, 15))) for _ in range(n_messages)]
+
+
+# the original implementations from utils.py, kept here as the baseline
+def legacy_most_common_words(texts):
+    from nltk.tokenize import word_tokenize
+    all_text = ' '.join(texts).lower().replace("'", ' ')
+    cleaned_text = re.sub(r'[^\w\s]', '', all_text)
+    stop_words = get_stop_words()
+    word_tokens = word_tokenize(cleaned_text)
+    words = [w for w in word_tokens if w not in stop_words and len(w.strip()) > 1]
+    if not words:
+        return None
+    return Counter(words).most_common(100)
+
+
+# per message tokens, like the grouped counters in prepare_data.py need
+def legacy_tokenize_each(texts):
+    from nltk.tokenize import word_tokenize
+    return [word_tokenize(re.sub(r'[^\w\s]', '', text.lower().replace("'", ' '))) for text in texts]
+
+
+def legacy_most_common_emoji(texts):
+    emoji_pattern = re.compile(
+        "["
+        "\U0001F600-\U0001F64F"  # emoticons
+        "\U0001F300-\U0001F5FF"  # symbols & pictographs
+        "\U0001F680-\U0001F6FF"  # transport & map symbols
+        "\U0001F1E0-\U0001F1FF"  # flags (iOS)
+        "\U00002700-\U000027BF"  # Dingbats
+        "\U0001F900-\U0001F9FF"  # Supplemental Symbols and Pictographs
+        "\U00002600-\U000026FF"  # Misc symbols
+        "]", flags=re.UNICODE)
+    emojis = []
+    for text in texts:
+        emojis.extend(emoji_pattern.findall(text))
+    if not emojis:
+        return None
+    return Counter(emojis).most_common(1)[0]
+
+
+def time_it(func, texts, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(texts)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(n_messages, repeat):
+    texts = make_corpus(n_messages)
+    get_stop_words() # don't count loading the stop words
+
+    runs = [
+        ("words (nltk word_tokenize)", lambda t: legacy_most_common_words(t)),
+        ("words (compiled regex)", lambda t: most_common_words(t, get_all=True)),
+        ("tokens per message (nltk)", legacy_tokenize_each),
+        ("tokens per message (series)", lambda t: tokenize_texts(t).tolist()),
+        ("emoji (per-text findall)", legacy_most_common_emoji),
+        ("emoji (joined findall)", most_common_emoji),
+    ]
+    results = {}
+    print(f"{n_messages} synthetic messages, best of {repeat}")
+    for name, func in runs:
+        seconds, results[name] = time_it(func, texts, repeat)
+        print(f"{name:30s} {seconds:8.3f}s {n_messages / seconds:12,.0f} messages/sec")
+
+    same_words = results["words (nltk word_tokenize)"] == results["words (compiled regex)"]
+    same_tokens = results["tokens per message (nltk)"] == results["tokens per message (series)"]
+    same_emoji = results["emoji (per-text findall)"] == results["emoji (joined findall)"]
+    print(f"same word counts: {same_words}, same tokens: {same_tokens}, same emoji counts: {same_emoji}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark word/emoji counting throughput")
+    parser.add_argument("--messages", type=int, default=100000, help="number of synthetic messages")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per implementation (the best time is reported)")
+    args = parser.parse_args()
+    main(args.messages, args.repeat)
@@ -0,0 +1,194 @@
+"""
+Resolves message handles (the phone number or email the message came from) to contact names
+Address book numbers and emails are normalized once (vectorized, no per-row python) into a lookup index:
+    numbers: canonical E.164 number (+14155550101) -> name
+    emails: lowercase email -> name
+    suffixes: last four digits (ZLASTFOURDIGITS) -> [[number, name], ...], the numbers a handle with no exact
+    match is compared against (see same_number), so numbers saved without their country/area code still match
+so every handle resolves with dictionary lookups instead of an exact-string merge
+The index is saved to data/contact_index.json and only rebuilt when the address book file changes
+"""
+
+import os
+import re
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+from instrument import stage
+
+contact_index_path = "data/contact_index.json"
+index_version = 2 # saved indexes of another version are rebuilt
+suffix_digits = 4 # the address book stores the last four digits of every number (ZLASTFOURDIGITS)
+min_shared_digits = 7 # digits a number written differently has to end with (at least the local number)
+max_extra_digits = 6 # digits the longer number can have in front of the shorter one (a country and area code)
+
+non_digit_pattern = re.compile(r"\D")
+# "+44 (0) 20 ..." style numbers, the (0) is only dialed from inside the country
+trunk_zero_pattern = re.compile(r"\(0\)")
+
+
+def normalize_phone_numbers(numbers, default_country_code="1"):
+    """
+    Convert a series of phone numbers written any which way to E.164 (+<country code><number>)
+    Numbers without a country code get default_country_code (US), short codes are left as just digits
+    """
+    numbers = pd.Series(numbers, dtype=object).fillna("").str.strip()
+    digits = numbers.str.replace(trunk_zero_pattern, "", regex=True).str.replace(non_digit_pattern, "", regex=True)
+    n_digits = digits.str.len()
+    normalized = np.select(
+        [numbers.str.startswith("+"),
+         digits.str.startswith("00") & (n_digits > 10),
+         n_digits == 10,
+         (n_digits == 11) & digits.str.startswith(default_country_code)],
+        ["+" + digits,
+         "+" + digits.str[2:],
+         "+" + default_country_code + digits,
+         "+" + digits],
+        default=digits)
+    return pd.Series(normalized, index=numbers.index, dtype=object)
+
+
+def normalize_handles(handles):
+    """
+    Normalize message handles: emails are lowercased, everything else is treated as a phone number
+    """
+    handles = pd.Series(handles, dtype=object).fillna("").str.strip()
+    is_email = handles.str.contains("@", regex=False)
+    return handles.str.lower().where(is_email, normalize_phone_numbers(handles))
+
+
+def read_address_book(conn):
+    """
+    Read contact names with their phone numbers and emails from the address book database
+    Returns (numbers, emails) dataframes, numbers has name, phone_number (E.164) and last_four columns
+    """
+    records = pd.read_sql_query("select Z_PK, ZFIRSTNAME, ZLASTNAME from ZABCDRECORD", conn)
+    records['name'] = (records['ZFIRSTNAME'].fillna('') + " " + records['ZLASTNAME'].fillna('')).str.strip()
+    records = records[['Z_PK', 'name']]
+
+    numbers = pd.read_sql_query("select Z_PK, ZOWNER, ZFULLNUMBER, ZLASTFOURDIGITS from ZABCDPHONENUMBER", conn)
+    numbers = pd.merge(numbers, records, left_on="ZOWNER", right_on="Z_PK", how="inner")
+    with stage("normalize phone numbers", rows_in=len(numbers)):
+        numbers['phone_number'] = normalize_phone_numbers(numbers['ZFULLNUMBER'])
+    # fall back to the end of the number when ZLASTFOURDIGITS is missing
+    numbers['last_four'] = numbers['ZLASTFOURDIGITS'].fillna(numbers['phone_number'].str[-suffix_digits:])
+
+    tables = set(pd.read_sql_query("select name from sqlite_master where type = 'table'", conn)['name'])
+    if "ZABCDEMAILADDRESS" in tables:
+        emails = pd.read_sql_query("select ZOWNER, ZADDRESS from ZABCDEMAILADDRESS", conn)
+        emails = pd.merge(emails, records, left_on="ZOWNER", right_on="Z_PK", how="inner")
+        emails['email'] = emails['ZADDRESS'].fillna('').str.strip().str.lower()
+        emails = emails[emails['email'] != ''][['name', 'email']]
+    else:
+        emails = pd.DataFrame(columns=['name', 'email'])
+
+    return numbers, emails
+
+
+def build_contact_index(numbers, emails=None):
+    """
+    Build the handle -> name lookup index from the address book numbers (and emails)
+    When a number or email is saved under more than one contact, the first one wins
+    """
+    numbers = numbers[numbers['phone_number'] != '']
+    index = {
+        "numbers": numbers.drop_duplicates('phone_number').set_index('phone_number')['name'].to_dict(),
+        "emails": {},
+        "suffixes": {},
+    }
+    if emails is not None and len(emails):
+        index["emails"] = emails.drop_duplicates('email').set_index('email')['name'].to_dict()
+
+    # the last four digits are only a bucket of numbers to compare a handle against, not a match on their own
+    last_four = numbers['last_four'] if 'last_four' in numbers else numbers['phone_number'].str[-suffix_digits:]
+    for suffix, number, name in zip(last_four, numbers['phone_number'], numbers['name']):
+        index["suffixes"].setdefault(suffix, []).append([number, name])
+    return index
+
+
+def shared_suffix_length(a, b):
+    # number of digits a and b end with in common
+    shared = 0
+    for x, y in zip(reversed(a), reversed(b)):
+        if x != y:
+            break
+        shared += 1
+    return shared
+
+
+def same_number(handle, number):
+    """
+    Whether a handle (E.164) and an address book number are the same number written differently:
+    the shorter one (at least min_shared_digits long) is the end of the longer one, which only has a country
+    and/or area code (at most max_extra_digits) in front of it, e.g. +442079460018 and 020 7946 0018
+    (+ and trunk zeros are ignored)
+    Two full numbers that differ in any digit are never the same
+    """
+    a, b = handle.lstrip("+").lstrip("0"), number.lstrip("+").lstrip("0")
+    shared = shared_suffix_length(a, b)
+    return (shared >= min_shared_digits and shared == min(len(a), len(b))
+            and max(len(a), len(b)) - shared <= max_extra_digits)
+
+
+def match_suffix(handle, candidates):
+    """
+    The contact name of the one contact with a number that's the same as handle, None if there's none
+    (or if numbers of more than one contact match)
+    """
+    names = {name for number, name in candidates if same_number(handle, number)}
+    return names.pop() if len(names) == 1 else None
+
+
+def resolve_handles(handles, index, report=True):
+    """
+    Look up the contact name for every handle in a series: exact E.164 number or lowercase email first,
+    then the address book numbers with the same last four digits, for numbers saved without their
+    country/area code (see same_number)
+    Returns a series of names (NaN where the handle isn't a contact)
+    """
+    keys = normalize_handles(handles)
+    exact = keys.map(index["numbers"]).fillna(keys.map(index["emails"]))
+    # only real phone numbers get the suffix fallback (not emails or short codes)
+    is_number = keys.str.startswith("+") & (keys.str.len() > suffix_digits + 1)
+    unmatched = keys[is_number & exact.isna()].unique()
+    matched = {key: match_suffix(key, index["suffixes"].get(key[-suffix_digits:], [])) for key in unmatched}
+    suffix = keys.map(matched).where(is_number & exact.isna())
+    names = exact.fillna(suffix)
+
+    if report:
+        print(f"Resolved {exact.notna().sum()} handles exactly, {suffix.notna().sum()} by a differently written number, "
+              f"{names.isna().sum()} not in contacts")
+    return names
+
+
+def contact_index_hash(index):
+    # hash of the lookups, the same hash means every handle resolves to the same contact
+    lookups = {key: index[key] for key in ["numbers", "emails", "suffixes"]}
+    return hashlib.sha256(json.dumps(lookups, sort_keys=True).encode()).hexdigest()
+
+
+def save_contact_index(index, source=None, path=contact_index_path):
+    """
+    Save the index, with the modified time of the address book it was built from (source)
+    """
+    saved = dict(index, version=index_version, source_mtime=os.path.getmtime(source) if source else None)
+    with open(path, "w") as f:
+        json.dump(saved, f, separators=(',', ':'))
+
+
+def load_contact_index(source=None, path=contact_index_path):
+    """
+    Load the saved index, returns None if there isn't one, it's from another version or the address book (source)
+    changed since
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        saved = json.load(f)
+    if saved.get("version") != index_version:
+        return None
+    if source is not None and saved.get("source_mtime") != os.path.getmtime(source):
+        return None
+    return {key: saved[key] for key in ["numbers", "emails", "suffixes"]}
@@ -0,0 +1,90 @@
+"""
+Word/emoji counts for every (year, month, day, person, sent/received) cell, built with one pass over the messages
+Any coarser grouping (year, year-month, year > person > sent/received, ...) is rolled up from the cells
+by merging their counts instead of re-tokenizing the texts, so daily stats are cheap too
+
+The cube is saved to data/text_cube/, one file per year so a year can be loaded (or rewritten) on its own:
+    index.json: {"keys": [...], "last_message_id": n, "years": [...], "contacts": hash of the contact index}
+    <year>.json: {"cells": [[year, month, day, first_name, is_from_me, count, {word: count}, {emoji: count}], ...]}
+"""
+
+import os
+import json
+
+from collections import Counter
+from parallel import parallel_group_counts, merge_group_counts, to_counters
+
+cube_keys = ['year', 'month', 'day', 'first_name', 'is_from_me']
+cube_dir = "data/text_cube"
+
+
+def build_cube(df, workers=1, shard_by="year"):
+    """
+    Count words and emoji for every cell of the cube (optionally across worker processes)
+    """
+    return parallel_group_counts(df, [cube_keys], workers, shard_by)[tuple(cube_keys)]
+
+
+def rollup(cube, keys):
+    """
+    Merge the cube cells up to the given keys (a subset of cube_keys, e.g. ['year', 'month'])
+    Returns {group key tuple: {"count": n, "words": Counter, "emoji": Counter}}
+    """
+    positions = [cube_keys.index(k) for k in keys]
+    merged = {}
+    for cell_key, cell in cube.items():
+        merge_group_counts(merged, {tuple(cell_key[i] for i in positions): cell})
+    return to_counters(merged)
+
+
+def select(cube, **filters):
+    """
+    Counts for one slice of the cube, e.g. select(cube, year=2023, first_name="Alex", is_from_me=True)
+    Returns {"count": n, "words": Counter, "emoji": Counter}
+    """
+    positions = {cube_keys.index(k): value for k, value in filters.items()}
+    cells = {cell_key: cell for cell_key, cell in cube.items()
+             if all(cell_key[i] == value for i, value in positions.items())}
+    groups = rollup(cells, [])
+    return groups.get((), {"count": 0, "words": Counter(), "emoji": Counter()})
+
+
+def save_cube(cube, last_message_id, years=None, contacts=None, path=cube_dir):
+    """
+    Save the cube one year per file, only the given years (e.g. the ones new messages were added to) if years is set
+    contacts is the hash of the contact index the messages were resolved with (contacts.contact_index_hash)
+    """
+    os.makedirs(path, exist_ok=True)
+    cells_by_year = {}
+    for cell_key, cell in sorted(cube.items()):
+        cells_by_year.setdefault(cell_key[0], []).append([*cell_key, cell["count"], cell["words"], cell["emoji"]])
+    for year, cells in cells_by_year.items():
+        if years is None or year in years:
+            with open(os.path.join(path, f"{year}.json"), "w") as f:
+                json.dump({"cells": cells}, f, separators=(',', ':'))
+    with open(os.path.join(path, "index.json"), "w") as f:
+        json.dump({"keys": cube_keys, "last_message_id": int(last_message_id), "years": list(cells_by_year),
+                   "contacts": contacts}, f)
+
+
+def load_cube(path=cube_dir, years=None, contacts=None):
+    """
+    Load a saved cube (only the given years if years is set), returns (cube, last_message_id)
+    or None if there isn't one yet or it was counted with another contact index than contacts (its hash),
+    since the messages would now go to other people (or be dropped/kept)
+    """
+    index_path = os.path.join(path, "index.json")
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path) as f:
+        index = json.load(f)
+    if contacts is not None and index.get("contacts") != contacts:
+        return None
+    cube = {}
+    for year in index["years"]:
+        if years is not None and year not in years:
+            continue
+        with open(os.path.join(path, f"{year}.json")) as f:
+            for *cell_key, count, words, emoji in json.load(f)["cells"]:
+                cube[tuple(cell_key)] = {"count": count, "words": words, "emoji": emoji}
+    return cube, index["last_message_id"]
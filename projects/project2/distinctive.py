@@ -0,0 +1,120 @@
+"""
+Finds the words that are distinctive for each (year, first_name, is_from_me) group, instead of just the most common
+The group word counts (from the cube, so the texts are only tokenized once) go into one sparse document-term matrix,
+a row per group and a column per word, and every group is scored at once with sparse/vectorized operations:
+- "log-odds": weighted log-odds ratio of the word in the group vs all the other groups, with an informative
+  dirichlet prior (Monroe, Colaresi & Quinn 2008), as a z-score so rare words aren't over-ranked
+- "tfidf": term frequency in the group times the (smoothed) inverse of how many groups use the word
+The top words of each group are returned as [word, count] pairs, like top_words, so they can go straight
+into the common_words field of the chart data
+"""
+
+import numpy as np
+
+try:
+    import scipy.sparse as sparse
+except ImportError:
+    sparse = None
+
+from utils import get_stop_words, other_common_words
+
+METHODS = ["log-odds", "tfidf"]
+
+
+def document_term_matrix(groups, remove_common_words=False):
+    """
+    Build the group x word count matrix from {group key: {"words": Counter, ...}} groups
+    Stop words (and common words with remove_common_words) are left out like in top_words
+    Returns (matrix, group keys in row order, vocabulary in column order)
+    """
+    if sparse is None:
+        raise ImportError("scipy is needed for distinctive words (python3 -m pip install scipy)")
+    stop_words = get_stop_words()
+    if remove_common_words:
+        stop_words = stop_words.union(other_common_words)
+
+    keys = sorted(groups)
+    # columns are numbered in order of first appearance, so ties keep the same order as the counters
+    vocabulary = {}
+    rows, columns, counts = [], [], []
+    for row, key in enumerate(keys):
+        for word, count in groups[key]["words"].items():
+            if word in stop_words or len(word.strip()) <= 1:
+                continue
+            rows.append(row)
+            columns.append(vocabulary.setdefault(word, len(vocabulary)))
+            counts.append(count)
+    matrix = sparse.csr_matrix((np.array(counts, dtype=np.float64), (rows, columns)),
+                               shape=(len(keys), len(vocabulary)))
+    return matrix, keys, list(vocabulary)
+
+
+def log_odds_scores(matrix, prior=0.01):
+    """
+    z-scored log-odds of each (group, word) vs the rest of the groups, for the words each group uses
+    prior is the total weight of the dirichlet prior per word of the corpus (scaled by how common the word is overall)
+    Returns a matrix with the same sparsity as the counts
+    """
+    coo = matrix.tocoo()
+    y = coo.data
+    word_totals = np.asarray(matrix.sum(axis=0)).ravel()
+    group_totals = np.asarray(matrix.sum(axis=1)).ravel()
+    total = word_totals.sum()
+
+    alpha0 = prior * len(word_totals)
+    alpha = alpha0 * word_totals[coo.col] / total
+    n_group = group_totals[coo.row]
+    y_rest = word_totals[coo.col] - y
+    n_rest = total - n_group
+
+    delta = (np.log((y + alpha) / (n_group + alpha0 - y - alpha))
+             - np.log((y_rest + alpha) / (n_rest + alpha0 - y_rest - alpha)))
+    variance = 1 / (y + alpha) + 1 / (y_rest + alpha)
+    return sparse.csr_matrix((delta / np.sqrt(variance), (coo.row, coo.col)), shape=matrix.shape)
+
+
+def tfidf_scores(matrix):
+    """
+    tf-idf of each (group, word): share of the group's words, times log((1 + groups) / (1 + groups using the word)) + 1
+    """
+    n_groups = matrix.shape[0]
+    document_frequency = np.bincount(matrix.indices, minlength=matrix.shape[1])
+    idf = np.log((1 + n_groups) / (1 + document_frequency)) + 1
+    group_totals = np.asarray(matrix.sum(axis=1)).ravel()
+    group_totals[group_totals == 0] = 1
+    tf = sparse.diags(1 / group_totals) @ matrix
+    return tf @ sparse.diags(idf)
+
+
+def top_scores(matrix, scores, n=15):
+    """
+    The n highest scoring words of every row, as (row, column, count) arrays sorted by row then score
+    (ties go to the word that appeared first)
+    """
+    counts = matrix.tocoo()
+    scores = scores.tocsr()
+    score = np.asarray(scores[counts.row, counts.col]).ravel()
+    order = np.lexsort((counts.col, -score, counts.row))
+    rows, columns, values = counts.row[order], counts.col[order], counts.data[order]
+    # rank of each word within its row
+    row_starts = np.searchsorted(rows, np.arange(matrix.shape[0]))
+    rank = np.arange(len(rows)) - row_starts[rows]
+    keep = rank < n
+    return rows[keep], columns[keep], values[keep]
+
+
+def distinctive_words(groups, method="log-odds", n=15, remove_common_words=False):
+    """
+    The n most distinctive words for every group: {group key: [[word, count], ...]} (None for groups without words)
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown method {method!r}, expected one of {METHODS}")
+    matrix, keys, vocabulary = document_term_matrix(groups, remove_common_words)
+    scores = log_odds_scores(matrix) if method == "log-odds" else tfidf_scores(matrix)
+
+    words = {key: None for key in keys}
+    for row, column, count in zip(*top_scores(matrix, scores, n)):
+        if words[keys[row]] is None:
+            words[keys[row]] = []
+        words[keys[row]].append([vocabulary[column], int(count)])
+    return words
@@ -0,0 +1,73 @@
+"""
+Keeps the message dataframe small enough for long (multi-million message) histories:
+- contact fields (phone_number, name, first_name) are categoricals, so each distinct value is stored once
+- the text is an arrow backed string column when pyarrow is installed, instead of one python object per message
+- year/month/day are derived from the date when a stage needs them, as int16/int8 columns
+memory_report prints the frame size and the peak memory of the process after each stage
+"""
+
+import sys
+import resource
+import pandas as pd
+
+try:
+    import pyarrow
+    text_dtype = "string[pyarrow]"
+except ImportError:
+    text_dtype = None
+
+contact_columns = ["phone_number", "name", "first_name"]
+date_part_dtypes = {"year": "int16", "month": "int8", "day": "int8"}
+
+
+def compact_messages(df):
+    """
+    Dictionary encode the contact columns and store the text in arrow (date parts are dropped, see with_date_parts)
+    """
+    df = df.drop(columns=[column for column in [*date_part_dtypes, "time"] if column in df])
+    df = df.astype({column: "category" for column in contact_columns if column in df})
+    if text_dtype is not None:
+        df['text'] = df['text'].astype(text_dtype)
+    return df
+
+
+def first_names(names):
+    """
+    First name (before the first space or hyphen) for a categorical series of names,
+    splitting each distinct name once instead of every message
+    """
+    names = names.astype("category")
+    categories = names.cat.categories
+    firsts = pd.Series(categories, dtype=object).str.split().str[0].str.split('-').str[0]
+    return names.map(dict(zip(categories, firsts))).astype("category")
+
+
+def with_date_parts(df, columns):
+    """
+    Add the year/month/day columns out of columns that the frame doesn't have yet, derived from the date
+    """
+    missing = [column for column in columns if column in date_part_dtypes and column not in df]
+    if not missing:
+        return df
+    dates = df['date'].dt
+    return df.assign(**{column: getattr(dates, column).astype(date_part_dtypes[column]) for column in missing})
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def frame_mb(df):
+    return df.memory_usage(deep=True).sum() / 1024 ** 2
+
+
+def memory_report(stage, df):
+    """
+    Print how much memory the message frame (by column) and the whole process are using after a stage
+    """
+    columns = ", ".join(f"{column} {size / 1024 ** 2:.1f}" for column, size in
+                        df.memory_usage(deep=True, index=False).items())
+    print(f"[memory] {stage}: {len(df)} rows, frame {frame_mb(df):.1f} MB ({columns}), "
+          f"peak process {peak_rss_mb():.1f} MB")
@@ -1,12 +1,19 @@
 """
 Extract the data from the apple database files
-Do some basic cleaning/filtering and save parsed down data to CSVs
+Do some basic cleaning/filtering and save parsed down data to parquet (or CSVs)
 """
 
-import re
+import os
+import json
 import sqlite3
+import argparse
 import pandas as pd
-import csv
+
+from storage import FORMATS, default_format, table_path, write_table, TableWriter
+from contacts import read_address_book, build_contact_index, save_contact_index, load_contact_index, resolve_handles
+from search_index import SearchIndex, index_last_rowid
+from attributed_body import BodyDecoder, default_workers
+from instrument import start_run, stage, finish_run
 
 pd.set_option('display.max_columns', None)
 
@@ -14,6 +21,12 @@ lib_path = "/Users/KayK/Library/"
 chat_db_path = f"{lib_path}/Messages/chat.db"
 contacts_db_path = f"{lib_path}/Application Support/AddressBook/Sources/421B0BD6-7A47-414B-81EC-0ABE220BC4E2/AddressBook-v22.abcddb"
 
+# keeps track of the last message ROWID that has been written to data/messages
+ingest_state_path = "data/ingest_state.json"
+
+# fixed column types so every chunk (and every incremental run) saves the same schema
+message_dtypes = {"text": "string", "phone_number": "string", "chat_id": "Int64"}
+
 """
 Chat data i can use for my reference:
 
@@ -48,109 +61,231 @@ Index(['ROWID', 'guid', 'text', 'replace', 'service_center', 'handle_id',
 
 """
 
-conn = sqlite3.connect(chat_db_path)
-conn2 = sqlite3.connect(contacts_db_path)
-
-# connect to database
-cur = conn.cursor()
-cur2 = conn2.cursor()
-
-cur.execute("select name from sqlite_master where type = 'table'")
-# for name in cur.fetchall():
-#     print(name)
-print(f"{'-' * 20}")
-cur2.execute("select name from sqlite_master where type = 'table'")
-
-
-# Read ZABCDRECORD and ZABCDPHONENUMBER, join on ZABCDPHONENUMBER.ZOWNER = ZABCDRECORD.Z_PK, keep ZFIRSTNAME and ZLASTNAME from ZABCDRECORD
-zabcdrecord = pd.read_sql_query("select Z_PK, ZFIRSTNAME, ZLASTNAME from ZABCDRECORD", conn2)
-zabcdphonenumber = pd.read_sql_query("select * from ZABCDPHONENUMBER", conn2)
-contacts = pd.merge(zabcdphonenumber, zabcdrecord, left_on="ZOWNER", right_on="Z_PK", how="inner")
-contacts = contacts[[
-    "ZFULLNUMBER",
-    "ZLASTFOURDIGITS",
-    "ZFIRSTNAME",
-    "ZLASTNAME",
-    "ZOWNER",
-    "Z_PK_x",
-    "Z_PK_y",
-    # "ZUNIQUEID"
-]]
-
-# Function to standardize phone numbers
-def standardize_phone_number(number):
-    if "(" not in number and "+" in number:
-        # already standardized, just return it
-        return number
-    
-    country_code = number.split("(")[0].strip().replace('+', '')
-    if country_code == '':
-        country_code = '1' # default to US phone #
-    else:
-        number = number.split("(")[-1].strip()
-
-    # Remove all characters except digits
-    cleaned = re.sub(r'[^\d+]', '', number)
-
-    return f"+{country_code}{cleaned}"
-
-contacts['phone_number'] = contacts['ZFULLNUMBER'].apply(standardize_phone_number)
-contacts['ZFIRSTNAME'] = contacts['ZFIRSTNAME'].fillna('')
-contacts['ZLASTNAME'] = contacts['ZLASTNAME'].fillna('')
-contacts['name'] = (contacts['ZFIRSTNAME'] + " " + contacts['ZLASTNAME']).str.strip()
-df_contacts = contacts[[
-    "name",
-    "phone_number",
-    "Z_PK_x",
-    "Z_PK_y"
-]]
-
-print(contacts.head())
-print(len(contacts))
-
-messages = pd.read_sql_query("select * from message order by ROWID desc", conn) # limit 10000
-print(f"{'-' * 20}")
-
-
-# get the handles to apple-id mapping table
-handles = pd.read_sql_query("select * from handle", conn)
-# and join to the messages, on handle_id
-messages.rename(columns={'ROWID' : 'message_id'}, inplace = True)
-handles.rename(columns={'id' : 'phone_number', 'ROWID': 'handle_id'}, inplace = True)
-merge_level_1 = temp = pd.merge(messages[['text', 
-                                          'handle_id', 
-                                          'date',
-                                          'message_id',
-                                          #'is_sent', seems to convey same info as 'is_from_me'
-                                          'is_from_me',
-                                          #'is_spam', none of these are marked as spam anyway
-                                          'is_emote',
-                                          'is_audio_message']],  
-                                handles[['handle_id',
-                                         'phone_number']],
-                                on ='handle_id', how='left')
-
-chats = pd.read_sql_query("select * from chat", conn)
-#print(chats.iloc[10])
-#print(handles.iloc[10])
-
-# get the chat to message mapping
-chat_message_joins = pd.read_sql_query("select * from chat_message_join", conn)
-# and join back to the merge_level_1 table
-df_messages = pd.merge(merge_level_1, chat_message_joins[['chat_id', 'message_id']], on = 'message_id', how='left')
-
-print(len(df_messages))
-# print(df_messages["text"].value_counts()) # helpful later on for getting common msgs?
-
-df_messages = df_messages.dropna(subset="text")
-print(len(df_messages))
-
-# Convert nanoseconds to milliseconds (ms precision)
-df_messages['date'] = df_messages['date'].divide(1000000)
-# Convert Apple epoch (2001-01-01) milliseconds timestamp to human-readable datetime in Pacific Time
-df_messages['date'] = pd.to_datetime(df_messages['date'], unit='ms', origin=pd.Timestamp('2001-01-01')).dt.round('1s')
-df_messages['date'] = df_messages['date'].dt.tz_localize('UTC').dt.tz_convert('America/Los_Angeles').dt.tz_localize(None)
-print(df_messages.head(10))
-
-df_contacts.to_csv("data/contacts.csv",index=False)
-df_messages.to_csv("data/messages.csv",index=False, quoting=csv.QUOTE_ALL)
+def read_contacts(conn2):
+    """
+    Read contact names and phone numbers (normalized to E.164) and emails from the address book database
+    """
+    with stage("read contacts") as record:
+        numbers, emails = read_address_book(conn2)
+        record["rows_out"] = len(numbers) + len(emails)
+    df_contacts = numbers[[
+        "name",
+        "phone_number",
+        "Z_PK_x",
+        "Z_PK_y"
+    ]]
+
+    print(numbers.head())
+    print(len(numbers))
+    return df_contacts, numbers, emails
+
+# only the message columns we keep, with the handle/chat joins and the text filter done by sqlite
+# (select * pulls ~90 columns including the attributedBody/payload_data blobs)
+# when decoding attributedBody, the blob is only read for the messages without text
+message_query = """
+    select m.text,{body_column}
+           m.handle_id,
+           m.date,
+           m.ROWID as message_id,
+           m.is_from_me, -- is_sent seems to convey same info as is_from_me
+           m.is_emote, -- is_spam isn't used, none of these are marked as spam anyway
+           m.is_audio_message,
+           h.id as phone_number,
+           cmj.chat_id
+    from message m
+    left join handle h on h.ROWID = m.handle_id
+    left join chat_message_join cmj on cmj.message_id = m.ROWID
+    where m.ROWID > ? and m.ROWID <= ? and {text_filter}
+    order by m.ROWID desc
+"""
+body_column = "\n           case when m.text is null then m.attributedBody end as attributedBody,"
+body_filter = "(m.text is not null or m.attributedBody is not null)"
+
+def get_last_rowid(conn, since_rowid=0):
+    """
+    Highest message ROWID currently in the database (including messages without text)
+    """
+    cur = conn.execute("select max(ROWID) from message")
+    last_rowid = cur.fetchone()[0]
+    return last_rowid if last_rowid is not None else since_rowid
+
+def iter_message_chunks(conn, since_rowid, last_rowid, chunk_size=50000, with_body=False):
+    """
+    Stream the joined messages with since_rowid < ROWID <= last_rowid in chunks of chunk_size rows
+    with_body also streams the messages without text, with their attributedBody
+    """
+    query = message_query.format(body_column=body_column if with_body else "",
+                                 text_filter=body_filter if with_body else "m.text is not null")
+    chunks = pd.read_sql_query(query, conn, params=(since_rowid, last_rowid), chunksize=chunk_size)
+    while True:
+        with stage("sql read messages") as record:
+            df_messages = next(chunks, None)
+            record["rows_out"] = 0 if df_messages is None else len(df_messages)
+        if df_messages is None:
+            return
+        if df_messages.empty:
+            # no new messages (the date column of an empty chunk can't be converted)
+            continue
+        yield df_messages
+
+def clean_messages(chunks):
+    """
+    Convert the apple timestamps of each chunk of messages to datetimes and set the column types
+    """
+    for df_messages in chunks:
+        with stage("clean messages", rows_in=len(df_messages)) as record:
+            df_messages = df_messages.astype(message_dtypes)
+            # Convert nanoseconds to milliseconds (ms precision)
+            df_messages['date'] = df_messages['date'].divide(1000000)
+            # Convert Apple epoch (2001-01-01) milliseconds timestamp to human-readable datetime in Pacific Time
+            df_messages['date'] = pd.to_datetime(df_messages['date'], unit='ms', origin=pd.Timestamp('2001-01-01')).dt.round('1s')
+            df_messages['date'] = df_messages['date'].dt.tz_localize('UTC').dt.tz_convert('America/Los_Angeles').dt.tz_localize(None)
+            record["rows_out"] = len(df_messages)
+        yield df_messages
+
+def decode_bodies(chunks, decoder):
+    """
+    Fill in the text of the messages that only have it in their attributedBody blob,
+    the messages that still don't have any text (attachments only, or blobs that can't be decoded) are dropped
+    """
+    for df_messages in chunks:
+        missing = df_messages['text'].isna()
+        with stage("decode attributedBody", rows_in=int(missing.sum())) as record:
+            texts = decoder.decode(df_messages.loc[missing, 'attributedBody'])
+            df_messages = df_messages.assign(text=df_messages['text'].fillna(texts)).drop(columns='attributedBody')
+            df_messages = df_messages[df_messages['text'].notna()]
+            record["rows_out"] = int(texts.notna().sum())
+        if len(df_messages):
+            yield df_messages
+
+def read_messages(conn, since_rowid=0, chunk_size=50000, decoder=None, last_rowid=None):
+    """
+    Stream messages (joined to their handle and chat) with a ROWID greater than since_rowid
+    since_rowid=0 reads the whole message table
+    With a decoder (attributed_body.BodyDecoder) the messages without text get it from their attributedBody
+    last_rowid stops at that ROWID (by default the highest one in the database when this is called)
+    Returns a generator of cleaned message chunks and the highest ROWID that will be read
+    """
+    if last_rowid is None:
+        last_rowid = get_last_rowid(conn, since_rowid)
+    chunks = iter_message_chunks(conn, since_rowid, last_rowid, chunk_size, with_body=decoder is not None)
+    if decoder is not None:
+        chunks = decode_bodies(chunks, decoder)
+    return clean_messages(chunks), last_rowid
+
+def write_messages(chunks, fmt=default_format, append=False):
+    """
+    Save message chunks to data/messages one at a time, returns the number of messages written
+    """
+    with TableWriter("messages", fmt, append=append) as writer:
+        for i, df_messages in enumerate(chunks):
+            if i == 0:
+                print(df_messages.head(10))
+            with stage(f"write messages ({fmt})", rows_in=len(df_messages)):
+                writer.write(df_messages)
+        if writer.rows == 0 and not append:
+            # still save the columns so prepare_data.py can read the table
+            writer.write(pd.DataFrame({"text": [], "handle_id": [], "date": [], "message_id": [], "is_from_me": [],
+                                       "is_emote": [], "is_audio_message": [], "phone_number": [], "chat_id": []}))
+    return writer.rows
+
+def add_to_search_index(chunks, index, contact_index):
+    """
+    Also add each chunk of messages (with the contact name) to the search database as it goes by
+    """
+    for df_messages in chunks:
+        with stage("write search index", rows_in=len(df_messages)):
+            names = resolve_handles(df_messages["phone_number"], contact_index, report=False)
+            index.add(df_messages.assign(name=names))
+        yield df_messages
+
+def update_search_index(conn, since_rowid, last_rowid, chunks, incremental=False, chunk_size=50000, decoder=None):
+    """
+    Keep data/messages.db in step with data/messages: the chunks read for data/messages are added to it too,
+    unless it is behind (or hasn't been built yet), then it catches up with its own read of the messages after it
+    The catch up read stops at the same last_rowid as the main read, so messages that arrive in chat.db in
+    between aren't added now and again by the next incremental run
+    Returns the chunks to write to data/messages and the index (call finish on it once the chunks are written)
+    """
+    index_rowid = (index_last_rowid() if incremental else None) or 0
+    index = SearchIndex(append=bool(index_rowid))
+    contact_index = load_contact_index()
+    if index_rowid == since_rowid:
+        return add_to_search_index(chunks, index, contact_index), index
+
+    print(f"Updating the search index from ROWID {index_rowid}")
+    index_chunks, _ = read_messages(conn, index_rowid, chunk_size, decoder, last_rowid=last_rowid)
+    for _ in add_to_search_index(index_chunks, index, contact_index):
+        pass
+    return chunks, index
+
+def load_ingest_state(fmt=default_format):
+    if not os.path.exists(ingest_state_path) or not os.path.exists(table_path("messages", fmt)):
+        return {"last_rowid": 0}
+    with open(ingest_state_path) as f:
+        return json.load(f)
+
+def save_ingest_state(state):
+    with open(ingest_state_path, "w") as f:
+        json.dump(state, f)
+
+def main(chat_db=chat_db_path, contacts_db=contacts_db_path, incremental=False, chunk_size=50000, fmt=default_format,
+         profile=False, search_index=False, decode_body=True, decode_workers=default_workers):
+    start_run("get_parse_data", profile=profile)
+    conn = sqlite3.connect(chat_db)
+    conn2 = sqlite3.connect(contacts_db)
+
+    df_contacts, numbers, emails = read_contacts(conn2)
+    with stage(f"write contacts ({fmt})", rows_in=len(df_contacts)):
+        write_table(df_contacts, "contacts", fmt)
+
+    # the handle -> contact lookup index is only rebuilt when the address book has changed
+    if load_contact_index(source=contacts_db) is None:
+        with stage("build contact index", rows_in=len(numbers) + len(emails)):
+            save_contact_index(build_contact_index(numbers, emails), source=contacts_db)
+        print("Built the contact index")
+
+    # in incremental mode only pull messages newer than the last run and append them
+    since_rowid = load_ingest_state(fmt)["last_rowid"] if incremental else 0
+    if since_rowid:
+        print(f"Reading messages after ROWID {since_rowid}")
+    decoder = BodyDecoder(decode_workers) if decode_body else None
+    chunks, last_rowid = read_messages(conn, since_rowid, chunk_size, decoder)
+    index = None
+    if search_index:
+        chunks, index = update_search_index(conn, since_rowid, last_rowid, chunks, incremental, chunk_size, decoder)
+    total = write_messages(chunks, fmt, append=bool(since_rowid))
+    if decoder is not None:
+        decoder.report()
+        decoder.close()
+
+    save_ingest_state({"last_rowid": last_rowid})
+    print(f"Wrote {total} messages, last ROWID is now {last_rowid}")
+    if index is not None:
+        with stage("optimize search index"):
+            index.finish(last_rowid)
+        print(f"Added {index.rows} messages to the search index ({index.path})")
+        index.close()
+    finish_run()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract messages and contacts from the apple database files")
+    parser.add_argument("--chat-db", default=chat_db_path, help="path to the Messages chat.db file")
+    parser.add_argument("--contacts-db", default=contacts_db_path, help="path to the AddressBook .abcddb file")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only read messages newer than the last run and append them to data/messages")
+    parser.add_argument("--chunk-size", type=int, default=50000, help="number of messages to read from sqlite at a time")
+    parser.add_argument("--format", choices=FORMATS, default=default_format,
+                        help="file format for data/messages and data/contacts (parquet needs pyarrow)")
+    parser.add_argument("--profile", action="store_true",
+                        help="run each stage under cProfile and save the slowest stage's profile to data/")
+    parser.add_argument("--no-decode-body", action="store_true",
+                        help="only keep messages with message.text, without decoding the attributedBody of the rest")
+    parser.add_argument("--decode-workers", type=int, default=default_workers,
+                        help="processes used to decode attributedBody blobs")
+    parser.add_argument("--search-index", action="store_true",
+                        help="also save the messages to data/messages.db with a full-text index (see search_index.py)")
+    args = parser.parse_args()
+    main(args.chat_db, args.contacts_db, incremental=args.incremental, chunk_size=args.chunk_size, fmt=args.format,
+         profile=args.profile, search_index=args.search_index, decode_body=not args.no_decode_body,
+         decode_workers=args.decode_workers)
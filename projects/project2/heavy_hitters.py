@@ -0,0 +1,167 @@
+"""
+Approximate top-k counting in a fixed amount of memory, for corpus-wide word/emoji/website counts where
+only the top 15-100 are used but an exact Counter would keep every distinct (typo'd) token
+
+SpaceSaving (Metwally, Agrawal & El Abbadi 2005) keeps at most capacity items. An item that isn't kept yet
+replaces the item with the smallest count and starts from that count (which is remembered as its error)
+With N the total of all the counts added and k the capacity:
+- every item counted more than N / k times is in the summary
+- a count is never under the true count and over it by at most its error, which is at most N / k:
+  count - error <= true count <= count
+- summaries of different chunks (or worker processes) can be merged and keep the same bounds
+  (Cafaro, Pulimeno & Tempesta 2016), see merge
+
+    summary = SpaceSaving(1000)
+    for chunk in chunks:
+        summary.update_counts(Counter(chunk))
+    summary.top(100)
+"""
+
+import sys
+import heapq
+
+from collections import Counter
+
+
+class SpaceSaving:
+    """
+    Estimated counts of (at most) the capacity most frequent items, see the bounds above
+    """
+
+    def __init__(self, capacity=1000):
+        if capacity < 1:
+            raise ValueError(f"capacity has to be at least 1, got {capacity}")
+        self.capacity = capacity
+        self.counts = {}  # item -> estimated count
+        self.errors = {}  # item -> how much the count can be over
+        self.total = 0
+        # (count, order, item) of the kept items, can have stale entries for items whose count went up since
+        self._heap = []
+        self._order = 0
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __contains__(self, item):
+        return item in self.counts
+
+    def _push(self, item):
+        heapq.heappush(self._heap, (self.counts[item], self._order, item))
+        self._order += 1
+        if len(self._heap) > 4 * self.capacity:
+            self._rebuild_heap()
+
+    def _rebuild_heap(self):
+        self._heap = [(count, i, item) for i, (item, count) in enumerate(self.counts.items())]
+        heapq.heapify(self._heap)
+        self._order = len(self._heap)
+
+    def min_count(self):
+        """
+        Most an item that isn't in the summary can have been counted (0 until the summary is full)
+        """
+        if len(self.counts) < self.capacity:
+            return 0
+        while True:
+            count, _, item = self._heap[0]
+            if self.counts.get(item) == count:
+                return count
+            heapq.heappop(self._heap)
+
+    def update(self, item, weight=1):
+        """
+        Count item weight more times
+        """
+        self.total += weight
+        if item not in self.counts and len(self.counts) >= self.capacity:
+            smallest = self.min_count()
+            _, _, evicted = heapq.heappop(self._heap)
+            del self.counts[evicted], self.errors[evicted]
+            self.counts[item], self.errors[item] = smallest, smallest
+        self.counts[item] = self.counts.get(item, 0) + weight
+        self.errors.setdefault(item, 0)
+        self._push(item)
+
+    def update_counts(self, counts):
+        """
+        Add the exact counts of a chunk ({item: count}, e.g. a Counter), much faster than one update per item
+        """
+        self._merge(counts, {}, sum(counts.values()), 0)
+
+    def merge(self, other):
+        """
+        Add another summary's counts (e.g. from another chunk or worker) into this one
+        """
+        self._merge(other.counts, other.errors, other.total, other.min_count())
+
+    def _merge(self, counts, errors, total, other_min):
+        # an item missing from one summary could have been counted up to that summary's smallest count
+        own_min = self.min_count()
+        merged_counts, merged_errors = {}, {}
+        items = list(self.counts) + [item for item in counts if item not in self.counts]
+        for item in items:
+            merged_counts[item] = self.counts.get(item, own_min) + counts.get(item, other_min)
+            merged_errors[item] = self.errors.get(item, own_min) + errors.get(item, other_min)
+        # keep the capacity largest (ties keep the item seen first)
+        kept = heapq.nlargest(self.capacity, merged_counts, key=merged_counts.get)
+        self.counts = {item: merged_counts[item] for item in kept}
+        self.errors = {item: merged_errors[item] for item in kept}
+        self.total += total
+        self._rebuild_heap()
+
+    def top(self, n=None):
+        """
+        The n items with the highest counts as (item, count) pairs, like Counter.most_common
+        """
+        return Counter(self.counts).most_common(n)
+
+    def bounds(self, item):
+        """
+        (lowest, highest) the true count of item can be
+        """
+        if item not in self.counts:
+            return 0, self.min_count()
+        return self.counts[item] - self.errors[item], self.counts[item]
+
+    def guaranteed_top(self, n):
+        """
+        The items of top(n) that are certainly in the true top n (their lowest possible count is
+        at least the highest possible count of every item outside of top(n))
+        """
+        top = self.top(n + 1)
+        threshold = top[n][1] if len(top) > n else self.min_count()
+        return [(item, count) for item, count in top[:n] if count - self.errors[item] >= threshold]
+
+    def error_bound(self):
+        # no count is over by more than this
+        return self.total / self.capacity
+
+    def counter(self):
+        """
+        The estimated counts as a Counter, to use in place of an exact one (e.g. with utils.top_words)
+        """
+        return Counter(dict(self.top()))
+
+    def memory_bytes(self):
+        # size of the dicts and the items/counts they hold (the heap is at most 4x the capacity)
+        return (sys.getsizeof(self.counts) + sys.getsizeof(self.errors) + sys.getsizeof(self._heap)
+                + sum(sys.getsizeof(item) + sys.getsizeof(count) for item, count in self.counts.items()))
+
+
+def top_counts(count_dicts, capacity=1000, chunk_items=100000):
+    """
+    Approximate counts of every item in a stream of {item: count} dicts (e.g. one per cube cell) or lists of items
+    They are added up exactly until chunk_items distinct items have been seen, then folded into a SpaceSaving
+    summary, so memory stays around chunk_items + capacity items however many distinct items there are
+    Returns the SpaceSaving summary
+    """
+    summary = SpaceSaving(capacity)
+    chunk = Counter()
+    for counts in count_dicts:
+        chunk.update(counts)
+        if len(chunk) >= chunk_items:
+            summary.update_counts(chunk)
+            chunk = Counter()
+    if chunk:
+        summary.update_counts(chunk)
+    return summary
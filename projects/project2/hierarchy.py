@@ -0,0 +1,111 @@
+"""
+Writes the year > person > sent/received hierarchy used by the d3 chart in the sketch
+The tree is built and written one year at a time (so only one year is ever in memory), as minified JSON:
+{"name":"lifetime","children":[{year},{year},...],"value":n}
+
+Optionally also writes
+- a gzip compressed copy next to each file (data/text_counts.json.gz), the sketch can load either
+- one file per year in data/text_counts/<year>.json with data/text_counts/index.json listing them,
+  so the sketch can download the years separately (and only re-download the years that changed)
+"""
+
+import os
+import gzip
+import json
+import itertools
+
+from utils import top_words, top_emoji
+from instrument import stage
+
+is_from_me = {
+    1: "Sent", 0: "Received"
+}
+
+
+def year_nodes(groups, remove_common_words=False, common_words=None):
+    """
+    Turn the (year, first_name, is_from_me) group counters into the nested name/value objects
+    for one year at a time
+    common_words ({group key: [[word, count], ...]}, e.g. from distinctive.py) replaces the most common words
+    """
+    for year, people in itertools.groupby(sorted(groups.items()), key=lambda item: item[0][0]):
+        with stage("top words/emoji per group"):
+            year_obj = {"name": str(year), "children": [], "value": 0}
+            for person, sent_received in itertools.groupby(people, key=lambda item: item[0][1]):
+                person_obj = {"name": person, "children": [], "value": 0}
+                for (y, p, sent), group in sent_received:
+                    if common_words is None:
+                        group_words = top_words(group["words"], remove_common_words=remove_common_words)
+                    else:
+                        group_words = common_words.get((y, p, sent))
+                    common_emoji = top_emoji(group["emoji"])
+                    sent_received_obj = {"name": is_from_me[sent],
+                                         "value": int(group["count"]),
+                                         "common_words": group_words,
+                                         "common_emoji": common_emoji}
+                    person_obj["children"].append(sent_received_obj)
+                    person_obj["value"] += int(group["count"])
+                year_obj["children"].append(person_obj)
+                year_obj["value"] += person_obj["value"]
+        yield year_obj
+
+
+def to_json(obj):
+    # minified, and emoji are written as utf-8 instead of \ud83d\ude02 escapes
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+
+def open_outputs(path, gzip_output=False):
+    files = [open(path, "w", encoding="utf-8")]
+    if gzip_output:
+        files.append(gzip.open(path + ".gz", "wt", encoding="utf-8"))
+    return files
+
+
+def write_all(files, text):
+    for f in files:
+        f.write(text)
+
+
+def write_hierarchy(years, path, gzip_output=False, year_shards=False):
+    """
+    Stream the year objects (from year_nodes) into one JSON file at path, and into one file per year
+    (in a folder named after the file) with year_shards
+    Returns the total number of messages
+    """
+    shard_dir = os.path.splitext(path)[0]
+    shards = []
+    if year_shards:
+        os.makedirs(shard_dir, exist_ok=True)
+        # years that aren't in the data anymore shouldn't be left behind
+        for file_name in os.listdir(shard_dir):
+            if file_name.endswith((".json", ".json.gz")):
+                os.remove(os.path.join(shard_dir, file_name))
+
+    files = open_outputs(path, gzip_output)
+    total_value = 0
+    try:
+        write_all(files, '{"name":"lifetime","children":[')
+        for i, year_obj in enumerate(years):
+            with stage("write json"):
+                year_json = to_json(year_obj)
+                write_all(files, ("," if i else "") + year_json)
+                if year_shards:
+                    shard_name = f"{year_obj['name']}.json"
+                    shard_files = open_outputs(os.path.join(shard_dir, shard_name), gzip_output)
+                    write_all(shard_files, year_json)
+                    for f in shard_files:
+                        f.close()
+                    shards.append({"name": year_obj["name"], "value": year_obj["value"], "url": shard_name})
+            total_value += year_obj["value"]
+        write_all(files, f'],"value":{total_value}}}')
+    finally:
+        for f in files:
+            f.close()
+
+    if year_shards:
+        index_files = open_outputs(os.path.join(shard_dir, "index.json"), gzip_output)
+        write_all(index_files, to_json({"name": "lifetime", "value": total_value, "shards": shards}))
+        for f in index_files:
+            f.close()
+    return total_value
@@ -0,0 +1,141 @@
+"""
+Records how long each named stage of a script takes (wall and CPU time), how many rows go in and out,
+and how much the process memory changes, then saves it all as a JSON run report in data/
+
+    start_run("prepare_data", profile=True)
+    with stage("load messages") as record:
+        df = read_table(...)
+        record["rows_out"] = len(df)
+    finish_run()
+
+A stage that runs more than once (e.g. once per chunk) is added up into one record with a call count
+With profile=True every top-level stage is run under cProfile and the slowest one's stats are saved to
+data/profile_<script>_<stage>.prof (open it with snakeviz, or flameprof for a flame graph)
+"""
+
+import os
+import re
+import json
+import time
+import pstats
+import cProfile
+
+from contextlib import contextmanager
+
+from frame import peak_rss_mb
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+report_dir = "data"
+
+run = {"script": None, "started": None, "profile": False, "stages": {}, "profiles": {}, "depth": 0}
+
+
+def current_rss_mb():
+    """
+    Memory the process is using right now (falls back to the peak when it can't be read)
+    """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 1024 ** 2
+    if os.path.exists("/proc/self/statm"):
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    return peak_rss_mb()
+
+
+def start_run(script, profile=False):
+    run.update(script=script, started=time.time(), profile=profile, stages={}, profiles={}, depth=0)
+
+
+@contextmanager
+def stage(name, rows_in=None):
+    """
+    Time the code in the with block as the named stage, set record["rows_out"] inside it to record the output rows
+    """
+    record = {"rows_in": rows_in, "rows_out": None}
+    # stages are listed in the order they started (so a stage comes before the stages inside it)
+    run["stages"].setdefault(name, {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0,
+                                    "rows_in": None, "rows_out": None, "memory_delta_mb": 0.0})
+    # cProfile can only profile one thing at a time, so stages inside another stage aren't profiled
+    profiler = cProfile.Profile() if run["profile"] and run["depth"] == 0 else None
+    memory_before = current_rss_mb()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    run["depth"] += 1
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        run["depth"] -= 1
+        add_record(name, record, time.perf_counter() - wall_start, time.process_time() - cpu_start,
+                   current_rss_mb() - memory_before)
+        if profiler is not None:
+            run["profiles"].setdefault(name, []).append(profiler)
+
+
+def add_record(name, record, wall_seconds, cpu_seconds, memory_delta_mb):
+    totals = run["stages"][name]
+    totals["calls"] += 1
+    totals["wall_seconds"] += wall_seconds
+    totals["cpu_seconds"] += cpu_seconds
+    totals["memory_delta_mb"] += memory_delta_mb
+    totals["peak_rss_mb"] = peak_rss_mb()
+    for rows in ["rows_in", "rows_out"]:
+        if record[rows] is not None:
+            totals[rows] = (totals[rows] or 0) + int(record[rows])
+
+
+def hottest_stage():
+    """
+    The stage that took the most wall time (out of the profiled top-level stages when profiling)
+    """
+    candidates = run["profiles"] or run["stages"]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda name: run["stages"][name]["wall_seconds"])
+
+
+def finish_run(path=None, top=15):
+    """
+    Save the run report (data/run_report_<script>.json by default) and, when profiling, the slowest stage's
+    cProfile stats, returns the report
+    """
+    report = {
+        "script": run["script"],
+        "started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(run["started"] or time.time())),
+        "wall_seconds": time.time() - run["started"] if run["started"] else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "hottest_stage": hottest_stage(),
+        "stages": run["stages"],
+    }
+
+    if run["profile"] and report["hottest_stage"] in run["profiles"]:
+        stats = pstats.Stats(*run["profiles"][report["hottest_stage"]])
+        safe_name = re.sub(r"\W+", "_", report["hottest_stage"]).strip("_")
+        report["profile"] = os.path.join(report_dir, f"profile_{run['script']}_{safe_name}.prof")
+        stats.dump_stats(report["profile"])
+        print(f"\nProfile of the slowest stage ({report['hottest_stage']}) saved to {report['profile']}")
+        stats.sort_stats("cumulative").print_stats(top)
+
+    path = path or os.path.join(report_dir, f"run_report_{run['script']}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=4)
+    print_run_report(report)
+    print(f"Run report saved to {path}")
+    return report
+
+
+def print_run_report(report, file=None):
+    # file=None prints to whatever sys.stdout is when it's called (so redirect_stdout catches the table)
+    print(f"\n{'stage':32s} {'calls':>5s} {'wall s':>8s} {'cpu s':>8s} {'rows in':>9s} {'rows out':>9s} {'mem MB':>8s}",
+          file=file)
+    for name, totals in report["stages"].items():
+        rows_in = "" if totals["rows_in"] is None else totals["rows_in"]
+        rows_out = "" if totals["rows_out"] is None else totals["rows_out"]
+        print(f"{name:32s} {totals['calls']:5d} {totals['wall_seconds']:8.3f} {totals['cpu_seconds']:8.3f} "
+              f"{rows_in:>9} {rows_out:>9} {totals['memory_delta_mb']:+8.1f}", file=file)
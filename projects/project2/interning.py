@@ -0,0 +1,139 @@
+"""
+Text interning: chat messages repeat a lot ("lol", "ok", tapbacks, the same links), so instead of
+tokenizing every message, each distinct string gets an id and is only analyzed (tokens, emoji, links) once
+Counts are then made by weighting each distinct string's results by how many times it occurs
+
+    interner = TextInterner({"words": tokenize_many})
+    codes, uniques = interner.intern(texts)             # codes[i] is the id of texts[i] in uniques
+    counts = occurrences(codes, len(uniques))           # how many times each distinct string was sent
+    words = interner.analyze(uniques, "words", counts)  # one result per distinct string
+    word_counts = weighted_counter(counts, words)       # same Counter as counting every message
+
+The results of strings that repeat are also kept in a bounded LRU cache, so strings seen in an earlier chunk
+(or shard, or call) aren't analyzed again either
+"""
+
+import time
+import numpy as np
+import pandas as pd
+
+from itertools import chain
+from collections import Counter, OrderedDict
+
+
+class TextInterner:
+    """
+    analyzers: {name: function(list of strings) -> list with one result per string}
+    cache_size: most distinct strings whose results are kept between calls, per analyzer
+    (words + emoji take about 1 KB per string)
+    """
+
+    def __init__(self, analyzers, cache_size=20000):
+        self.analyzers = analyzers
+        self.cache_size = cache_size
+        self._caches = {name: OrderedDict() for name in analyzers}  # string -> result, least recently used first
+        # text_analyses: how many times the analyzers would have run without interning (once per text)
+        self.stats = {"texts": 0, "unique": 0, "lookups": 0, "text_analyses": 0, "analyzed": 0,
+                      "analyze_seconds": 0.0}
+
+    def intern(self, texts):
+        """
+        Returns (codes, uniques): an id for every text (-1 for missing texts) and the distinct strings
+        in order of first appearance
+        """
+        codes, uniques = pd.factorize(pd.Series(texts, dtype=object))
+        self.stats["texts"] += int((codes >= 0).sum())
+        self.stats["unique"] += len(uniques)
+        return codes, list(uniques)
+
+    def analyze(self, uniques, name, counts=None):
+        """
+        The named analyzer's result for every distinct string, only running it on the strings that aren't cached
+        counts: how many times each string occurs (see occurrences), only strings that repeat are cached
+        since a string that was only sent once is unlikely to come up again
+        """
+        cache = self._caches[name]
+        results = [cache.get(text) for text in uniques]
+        missing = [i for i, result in enumerate(results) if result is None]
+        self.stats["lookups"] += len(uniques)
+        self.stats["text_analyses"] += len(uniques) if counts is None else int(counts.sum())
+
+        if missing:
+            started = time.perf_counter()
+            analyzed = self.analyzers[name]([uniques[i] for i in missing])
+            self.stats["analyze_seconds"] += time.perf_counter() - started
+            self.stats["analyzed"] += len(missing)
+            repeated = [True] * len(uniques) if counts is None else (counts > 1).tolist()
+            for i, result in zip(missing, analyzed):
+                results[i] = result
+                if repeated[i]:
+                    cache[uniques[i]] = result
+        if len(missing) < len(uniques):
+            # the strings found in the cache are now the most recently used
+            missing = set(missing)
+            for i, text in enumerate(uniques):
+                if i not in missing:
+                    cache.move_to_end(text)
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        return results
+
+    def snapshot(self):
+        return dict(self.stats)
+
+    def since(self, snapshot):
+        # the stats added since snapshot (e.g. by one shard in a worker process)
+        return {key: self.stats[key] - snapshot[key] for key in self.stats}
+
+    def add_stats(self, stats):
+        for key, value in stats.items():
+            self.stats[key] += value
+
+    def clear(self):
+        for cache in self._caches.values():
+            cache.clear()
+
+    def report(self, label="interning"):
+        """
+        Print the dedup ratio (texts per distinct string), the cache hits and the estimated time saved
+        (the time per analyzed string, for every text that didn't have to be analyzed)
+        """
+        stats = self.stats
+        if not stats["texts"]:
+            return
+        per_string = stats["analyze_seconds"] / stats["analyzed"] if stats["analyzed"] else 0
+        saved = per_string * (stats["text_analyses"] - stats["analyzed"])
+        print(f"[{label}] {stats['texts']} texts, {stats['unique']} distinct "
+              f"({stats['texts'] / max(stats['unique'], 1):.1f}x dedup), "
+              f"{stats['lookups'] - stats['analyzed']} cache hits, analyzed {stats['analyzed']} strings in "
+              f"{stats['analyze_seconds']:.2f}s, ~{saved:.2f}s saved")
+
+
+def occurrences(codes, n_uniques):
+    # how many times each distinct string occurs
+    return np.bincount(codes[codes >= 0], minlength=n_uniques)
+
+
+def weighted_counter(counts, results):
+    """
+    Counter of the items in each distinct string's results (lists), weighted by how often the string occurs
+    Items are in order of first appearance, like counting every text in order
+    """
+    lengths = np.fromiter(map(len, results), dtype=np.int64, count=len(results))
+    items = pd.Series(list(chain.from_iterable(results)), dtype=object)
+    if not len(items):
+        return Counter()
+    item_codes, unique_items = pd.factorize(items)
+    totals = np.bincount(item_codes, weights=np.repeat(counts, lengths), minlength=len(unique_items))
+    return Counter(dict(zip(unique_items, totals.astype(np.int64).tolist())))
+
+
+def token_table(results):
+    """
+    One row per (distinct string, token) from each string's token lists:
+    code, token and size (times the token is in the string)
+    """
+    lengths = np.fromiter((len(items) for items in results), dtype=np.int64, count=len(results))
+    table = pd.DataFrame({"code": np.repeat(np.arange(len(results)), lengths),
+                          "token": pd.Series([item for items in results for item in items], dtype=object)})
+    return table.groupby(["code", "token"], sort=False).size().reset_index(name="size")
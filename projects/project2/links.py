@@ -0,0 +1,76 @@
+"""
+Pulls every link out of the text messages in one pass and indexes them by website (domain)
+The website, spotify and youtube link files are all made from this one index
+"""
+
+import re
+import numpy as np
+import pandas as pd
+
+from utils import imsg_reaction_words
+from interning import TextInterner, occurrences
+
+# a url runs until whitespace or a quote, and doesn't end in punctuation like a trailing period or bracket
+url_pattern = re.compile(r"""https?://[^\s<>"“”‘’]*[^\s<>"“”‘’.,;:!?)\]}'*]""", flags=re.IGNORECASE)
+domain_pattern = re.compile(r"^https?://(?:www\.)?([^/?#:\s]+)", flags=re.IGNORECASE)
+
+# tapback reactions quote the message they react to, e.g. Loved “https://...” or Reacted 😂 to “...”
+# those are reactions to a link, not a link that was sent
+reaction_pattern = re.compile(r"^(?:" + "|".join(imsg_reaction_words) + r")\b[^“\"]*[“\"]", flags=re.IGNORECASE)
+
+spotify_domains = ["open.spotify.com"]
+youtube_domains = ["youtu.be", "youtube.com", "m.youtube.com", "music.youtube.com"]
+
+
+def find_links(texts):
+    # the urls in each text (none in tapback reactions)
+    return [[] if reaction_pattern.search(text) else url_pattern.findall(text) for text in texts]
+
+
+# the same links get sent (and reacted to) over and over, so each distinct text is only searched once
+link_interner = TextInterner({"links": find_links})
+
+
+def extract_links(texts):
+    """
+    Find every link in a series of texts (skipping tapback reactions)
+    Returns a dataframe with one row per link: message (the index of the text), url and domain
+    """
+    texts = pd.Series(texts, dtype=object)
+    codes, uniques = link_interner.intern(texts)
+    found = link_interner.analyze(uniques, "links", occurrences(codes, len(uniques)))
+    lengths = np.array([len(urls) for urls in found] + [0], dtype=np.int64)[codes]  # codes of -1 get the 0
+    urls = [url for code in codes[lengths > 0] for url in found[code]]
+    links = pd.DataFrame({"message": texts.index.repeat(lengths), "url": pd.Series(urls, dtype=object)})
+    links["domain"] = links["url"].str.extract(domain_pattern, expand=False).str.lower()
+    return links
+
+
+def domain_index(links):
+    """
+    Map each domain to the (unique) messages that link to it, in order of first appearance
+    """
+    return links.groupby("domain", sort=False)["message"].unique()
+
+
+def links_to(links, domains):
+    return links[links["domain"].isin(domains)]
+
+
+def save_link_files(links, min_count=2):
+    """
+    Save the spotify/youtube links and how many messages linked each website
+    (websites linked in fewer than min_count messages are left out)
+    """
+    # one row per link, under a text column like the original message files
+    links_to(links, spotify_domains)[["url"]].rename(columns={"url": "text"}).to_csv("data/spotify_linked.csv", index=False)
+    links_to(links, youtube_domains)[["url"]].rename(columns={"url": "text"}).to_csv("data/youtube_linked.csv", index=False)
+
+    counts = domain_index(links).map(len).sort_values(ascending=False, kind="stable")
+    print(counts)
+
+    counts = counts[counts >= min_count]
+    counts_df = counts.reset_index()
+    counts_df.columns = ['base_url', 'count']
+    counts_df.to_csv("data/websites_linked.csv", index=False)
+    return counts_df
@@ -0,0 +1,144 @@
+"""
+Multiprocess version of the word/emoji counting in prepare_data.py
+Messages are split into shards (by year or by conversation) and each worker process counts its shard,
+then the partial counts are merged (map-reduce). The merged counters list their tokens in alphabetical order
+(so ties come out the same however the messages were split), and the output files come out identical
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+from collections import Counter
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
+from utils import text_interner
+from interning import occurrences, token_table
+from frame import with_date_parts
+
+SHARD_BY = ["year", "chat"]
+default_workers = os.cpu_count() or 1
+
+
+def shard_messages(df, n_shards, shard_by="year"):
+    """
+    Split the messages into (at most) n_shards dataframes
+    "year" keeps every year in one shard (balancing shards by number of messages),
+    "chat" hashes the conversation (the other person's phone number/email)
+    """
+    if shard_by == "year":
+        shard_sizes = [0] * n_shards
+        shard_of_year = {}
+        for year, size in df['year'].value_counts().items():
+            shard = shard_sizes.index(min(shard_sizes))
+            shard_of_year[year] = shard
+            shard_sizes[shard] += size
+        shard_ids = df['year'].map(shard_of_year)
+    elif shard_by == "chat":
+        shard_ids = pd.util.hash_pandas_object(df['phone_number'], index=False) % n_shards
+    else:
+        raise ValueError(f"Unknown shard_by {shard_by!r}, expected one of {SHARD_BY}")
+    return [shard for _, shard in df.groupby(shard_ids.values, sort=True)]
+
+
+def python_scalar(value):
+    # numpy ints/bools -> python ones, so group keys print and compare like the serial ones
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def count_shard(shard, key_sets):
+    """
+    Worker: count words and emoji in one shard for every set of group keys
+    Every distinct text is tokenized once (interning.py) and its tokens are counted as many times as it occurs
+    Returns ({keys: {group key: {"count": n, "words": {token: count}, "emoji": {...}}}}, the interning stats of the shard)
+    """
+    snapshot = text_interner.snapshot()
+    codes, uniques = text_interner.intern(shard['text'])
+    shard = shard.assign(code=codes)
+    counts = occurrences(codes, len(uniques))
+    token_tables = {column: token_table(text_interner.analyze(uniques, column, counts))
+                    for column in ["words", "emoji"]}
+    results = {}
+    for keys in key_sets:
+        keys = list(keys)
+        rows = shard.dropna(subset=keys)
+        groups = {}
+        for group_key, count in rows.groupby(keys, sort=False, observed=True).size().items():
+            group_key = group_key if isinstance(group_key, tuple) else (group_key,)
+            groups[tuple(python_scalar(k) for k in group_key)] = {"count": int(count), "words": {}, "emoji": {}}
+
+        # each distinct text once per group, with how many times it's in the group
+        texts = rows.groupby(keys + ['code'], sort=False, observed=True).size().reset_index(name='texts')
+        for column, tokens in token_tables.items():
+            counted = texts.merge(tokens, on='code')
+            counted['count'] = counted['texts'] * counted['size']
+            stats = counted.groupby(keys + ['token'], sort=False, observed=True)['count'].sum()
+            for (*group_key, token), count in zip(stats.index, stats.values):
+                groups[tuple(python_scalar(k) for k in group_key)][column][token] = int(count)
+        results[tuple(keys)] = groups
+    return results, text_interner.since(snapshot)
+
+
+def merge_group_counts(merged_groups, groups):
+    """
+    Add the counts in groups into merged_groups
+    """
+    for group_key, group in groups.items():
+        merged_group = merged_groups.get(group_key)
+        if merged_group is None:
+            merged_groups[group_key] = {"count": group["count"], "words": dict(group["words"]), "emoji": dict(group["emoji"])}
+            continue
+        merged_group["count"] += group["count"]
+        for column in ["words", "emoji"]:
+            counts = merged_group[column]
+            for token, count in group[column].items():
+                counts[token] = counts.get(token, 0) + count
+    return merged_groups
+
+
+def merge_shard_counts(partials):
+    """
+    Reduce: add up the per-shard counts for every set of group keys
+    """
+    merged = {}
+    for partial in partials:
+        for keys, groups in partial.items():
+            merge_group_counts(merged.setdefault(keys, {}), groups)
+    return merged
+
+
+def to_counters(groups):
+    """
+    Turn merged counts into {"count", "words": Counter, "emoji": Counter} groups (for top_words/top_emoji),
+    with tokens in alphabetical order, so words with the same count come out of most_common alphabetically
+    """
+    counters = {}
+    for group_key, group in groups.items():
+        counters[group_key] = {"count": group["count"]}
+        for column in ["words", "emoji"]:
+            counters[group_key][column] = Counter(dict(sorted(group[column].items())))
+    return counters
+
+
+def parallel_group_counts(df, key_sets, workers=default_workers, shard_by="year"):
+    """
+    Count words/emoji for each set of group keys in key_sets, split across a pool of worker processes
+    Returns {tuple(keys): {group key: {"count": n, "words": {token: count}, "emoji": {...}}}}
+    """
+    columns = list(dict.fromkeys(['text', 'phone_number'] + [k for keys in key_sets for k in keys]))
+    df = with_date_parts(df, columns)[columns]
+    if workers <= 1:
+        return count_shard(df, key_sets)[0]
+
+    shards = shard_messages(df, workers, shard_by)
+    print(f"Counting {len(df)} messages in {len(shards)} shards (by {shard_by}) with {workers} workers")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        partials = []
+        for partial, stats in executor.map(count_shard, shards, repeat(key_sets)):
+            # the workers interned their own shards, add it to this process's stats for the report
+            text_interner.add_stats(stats)
+            partials.append(partial)
+        merged = merge_shard_counts(partials)
+    return {tuple(keys): merged.get(tuple(keys), {}) for keys in key_sets}
+
@@ -0,0 +1,292 @@
+"""
+Runs the whole pipeline (get_parse_data.py -> prepare_data.py -> spotify_data.py / youtube_data.py)
+skipping the stages whose inputs haven't changed since they last ran
+
+Each stage's inputs are hashed into a key: the scripts it runs (their source), its options, the files it reads
+(by content, or by modified time and size for the big ones like the messages table), and for the extract stage
+the apple databases (modified time, size and last message ROWID, they're too big to hash every run) and for
+prepare the stop words (the saved lists, or the nltk/spacy versions). A stage is skipped when its key and its
+output files are the same as after its last successful run (saved in data/pipeline_state.json).
+Since a stage's outputs are the next stage's inputs, re-running a stage only invalidates the stages after it
+if its outputs actually changed (or were rewritten, for the big ones). Each file is only fingerprinted once per run
+
+Run from projects/project2: python3 pipeline.py (--dry-run to see what would run, --force to run everything)
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+import argparse
+
+from importlib import metadata
+
+from storage import FORMATS, default_format, table_path
+
+pipeline_state_path = "data/pipeline_state.json"
+project_dir = os.path.dirname(os.path.abspath(__file__))
+# files/directories bigger than this are fingerprinted by modified time and size instead of hashed
+max_hash_bytes = 64 << 20
+
+# path -> fingerprint for this run, cleared when a stage rewrites the path
+fingerprints = {}
+
+
+def hash_file(path, digest):
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+
+
+def path_files(path):
+    # the file itself, or every file in a directory (e.g. a parquet table) in a fixed order
+    if not os.path.isdir(path):
+        return [path]
+    file_paths = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        file_paths += [os.path.join(root, file_name) for file_name in sorted(files)]
+    return file_paths
+
+
+def hash_path(path):
+    """
+    Content hash of a file, or of every file in a directory (e.g. a parquet table), None if it doesn't exist
+    """
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    for file_path in path_files(path):
+        if file_path != path:
+            digest.update(os.path.relpath(file_path, path).encode())
+        hash_file(file_path, digest)
+    return digest.hexdigest()
+
+
+def path_fingerprint(path):
+    """
+    Fingerprint of a stage's input or output: the content hash, or for paths bigger than max_hash_bytes
+    the modified time and size of each file (like database_fingerprint), None if it doesn't exist
+    Computed once per run and kept in fingerprints
+    """
+    if path not in fingerprints:
+        if not os.path.exists(path):
+            fingerprints[path] = None
+        else:
+            stats = {os.path.relpath(file_path, os.path.dirname(path)): os.stat(file_path)
+                     for file_path in path_files(path)}
+            if sum(stat.st_size for stat in stats.values()) > max_hash_bytes:
+                fingerprints[path] = {name: [stat.st_mtime, stat.st_size] for name, stat in stats.items()}
+            else:
+                fingerprints[path] = hash_path(path)
+    return fingerprints[path]
+
+
+def contact_index_hash(path="data/contact_index.json"):
+    # only the lookups, the index also saves when the address book was modified (which changes every extract)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        index = json.load(f)
+    index.pop("source_mtime", None)
+    return hashlib.sha256(json.dumps(index, sort_keys=True).encode()).hexdigest()
+
+
+def source_hash(*modules):
+    # the "version" of a stage is the source of the scripts it runs
+    return {module: hash_path(os.path.join(project_dir, module)) for module in modules}
+
+
+def database_fingerprint(path, table=None):
+    """
+    Cheap fingerprint of a (large) sqlite database: modified time and size of the file and its write-ahead log,
+    and the last ROWID of table (new messages can sit in chat.db-wal without changing chat.db)
+    """
+    fingerprint = {}
+    for file_path in [path, path + "-wal"]:
+        if os.path.exists(file_path):
+            stat = os.stat(file_path)
+            fingerprint[os.path.basename(file_path)] = [stat.st_mtime, stat.st_size]
+    if table is not None and os.path.exists(path):
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            fingerprint["last_rowid"] = conn.execute(f"select max(ROWID) from {table}").fetchone()[0]
+        finally:
+            conn.close()
+    return fingerprint
+
+
+def stop_words_hash():
+    """
+    What the stop words come from: the saved lists (utils.py --save-stop-words) if there are any,
+    otherwise the versions of nltk and spacy they're read from (without importing either, which is slow)
+    """
+    from utils import stop_words_cache_path
+    if os.path.exists(stop_words_cache_path):
+        return path_fingerprint(stop_words_cache_path)
+    versions = {}
+    for library in ["nltk", "spacy"]:
+        try:
+            versions[library] = metadata.version(library)
+        except metadata.PackageNotFoundError:
+            versions[library] = None
+    return versions
+
+
+def make_stages(chat_db, contacts_db, fmt=default_format, incremental=False, workers=1, shard_by="year",
+                gzip_output=False, year_shards=False, distinctive=None, search_index=False):
+    """
+    The pipeline stages in the order they run, each with:
+    inputs (a function returning what goes into its key), outputs (the files it writes) and run
+    """
+    def extract():
+        import get_parse_data
+        get_parse_data.main(chat_db, contacts_db, incremental=incremental, fmt=fmt, search_index=search_index)
+
+    def prepare():
+        import prepare_data
+        prepare_data.main(incremental=incremental, fmt=fmt, workers=workers, shard_by=shard_by,
+                          gzip_output=gzip_output, year_shards=year_shards, distinctive=distinctive,
+                          search_index=search_index)
+
+    def spotify():
+        import spotify_data
+        spotify_data.main()
+
+    def youtube():
+        import youtube_data
+        youtube_data.main()
+
+    return [
+        {"name": "extract",
+         "inputs": lambda: {"chat_db": database_fingerprint(chat_db, "message"),
+                            "contacts_db": database_fingerprint(contacts_db),
+                            "scripts": source_hash("get_parse_data.py", "contacts.py", "storage.py", "search_index.py",
+                                                   "attributed_body.py", "instrument.py", "frame.py"),
+                            "options": {"format": fmt, "incremental": incremental, "search_index": search_index}},
+         "outputs": [table_path("messages", fmt), table_path("contacts", fmt), "data/contact_index.json"]
+                    + (["data/messages.db"] if search_index else []),
+         "run": extract},
+        {"name": "prepare",
+         "inputs": lambda: {"files": {table_path("messages", fmt): path_fingerprint(table_path("messages", fmt))},
+                            "contact_index": contact_index_hash(),
+                            "stop_words": stop_words_hash(),
+                            "scripts": source_hash("prepare_data.py", "utils.py", "cube.py", "parallel.py",
+                                                   "links.py", "frame.py", "hierarchy.py", "contacts.py",
+                                                   "distinctive.py", "search_index.py", "heavy_hitters.py",
+                                                   "interning.py", "storage.py", "instrument.py"),
+                            # workers/shard_by aren't options here, they give the same output files
+                            "options": {"format": fmt, "incremental": incremental, "gzip": gzip_output,
+                                        "year_shards": year_shards, "distinctive": distinctive}},
+         "outputs": ["data/text_counts.json", "data/text_counts_no_common_words.json", "data/text_cube",
+                     "data/spotify_linked.csv", "data/youtube_linked.csv", "data/websites_linked.csv"],
+         "run": prepare},
+        {"name": "spotify",
+         "inputs": lambda: {"files": {"data/spotify_linked.csv": path_fingerprint("data/spotify_linked.csv")},
+                            "scripts": source_hash("spotify_data.py")},
+         "outputs": ["data/spotify_artists.csv"],
+         "run": spotify},
+        {"name": "youtube",
+         "inputs": lambda: {"files": {"data/youtube_linked.csv": path_fingerprint("data/youtube_linked.csv")},
+                            "scripts": source_hash("youtube_data.py", "utils.py", "heavy_hitters.py",
+                                                   "interning.py")},
+         "outputs": ["data/youtube_titles.csv", "data/youtube_title_counts.csv"],
+         "run": youtube},
+    ]
+
+
+def stage_key(inputs):
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def load_pipeline_state(path=pipeline_state_path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_pipeline_state(state, path=pipeline_state_path):
+    with open(path, "w") as f:
+        json.dump(state, f, indent=4)
+
+
+def is_up_to_date(stage, key, state):
+    """
+    A stage can be skipped when it last ran with the same key and its outputs are still what it wrote
+    """
+    saved = state.get(stage["name"])
+    if saved is None or saved["key"] != key:
+        return False
+    return all(path_fingerprint(path) is not None and path_fingerprint(path) == saved["outputs"].get(path)
+               for path in stage["outputs"])
+
+
+def run_pipeline(stages, only=None, force=False, dry_run=False):
+    """
+    Run the stages in order (only the ones named in only, if given), skipping up to date stages
+    Returns the names of the stages that ran
+    """
+    os.makedirs("data", exist_ok=True)
+    fingerprints.clear()
+    state = load_pipeline_state()
+    ran = []
+    would_run = []
+    for stage in stages:
+        if only and stage["name"] not in only:
+            continue
+        key = stage_key(stage["inputs"]())
+        if not force and is_up_to_date(stage, key, state):
+            if would_run:
+                # in a dry run the stages before it haven't actually written their new outputs
+                print(f"[pipeline] {stage['name']}: up to date, unless {', '.join(would_run)} changes its outputs")
+            else:
+                print(f"[pipeline] {stage['name']}: up to date, skipping")
+            continue
+        if dry_run:
+            print(f"[pipeline] {stage['name']}: inputs changed, would run")
+            would_run.append(stage["name"])
+            continue
+
+        print(f"[pipeline] {stage['name']}: running")
+        stage["run"]()
+        for path in stage["outputs"]:
+            fingerprints.pop(path, None)
+        state[stage["name"]] = {"key": key, "outputs": {path: path_fingerprint(path) for path in stage["outputs"]}}
+        save_pipeline_state(state)
+        ran.append(stage["name"])
+    return ran
+
+
+if __name__ == "__main__":
+    from get_parse_data import chat_db_path, contacts_db_path
+
+    stage_names = ["extract", "prepare", "spotify", "youtube"]
+    parser = argparse.ArgumentParser(description="Run the pipeline, skipping stages whose inputs haven't changed")
+    parser.add_argument("stages", nargs="*", help=f"only run these stages, out of {stage_names} (default: all of them)")
+    parser.add_argument("--chat-db", default=chat_db_path, help="path to the Messages chat.db file")
+    parser.add_argument("--contacts-db", default=contacts_db_path, help="path to the AddressBook .abcddb file")
+    parser.add_argument("--format", choices=FORMATS, default=default_format, help="format of the intermediate tables")
+    parser.add_argument("--incremental", action="store_true",
+                        help="extract and count only the messages that are new since the last run")
+    parser.add_argument("--workers", type=int, default=1, help="processes used to count words/emoji")
+    parser.add_argument("--shard-by", choices=["year", "chat"], default="year")
+    parser.add_argument("--gzip", action="store_true", help="also save gzip compressed chart JSON files")
+    parser.add_argument("--year-shards", action="store_true", help="also save the chart data as one file per year")
+    parser.add_argument("--distinctive", choices=["log-odds", "tfidf"],
+                        help="list each group's most distinctive words instead of its most common")
+    parser.add_argument("--search-index", action="store_true",
+                        help="keep a full-text index of the messages in data/messages.db, used for the link filters")
+    parser.add_argument("--force", action="store_true", help="run the stages even if they are up to date")
+    parser.add_argument("--dry-run", action="store_true", help="only print which stages would run")
+    args = parser.parse_args()
+    unknown = [name for name in args.stages if name not in stage_names]
+    if unknown:
+        parser.error(f"unknown stages {unknown}, expected some of {stage_names}")
+
+    stages = make_stages(args.chat_db, args.contacts_db, fmt=args.format, incremental=args.incremental,
+                         workers=args.workers, shard_by=args.shard_by, gzip_output=args.gzip,
+                         year_shards=args.year_shards, distinctive=args.distinctive, search_index=args.search_index)
+    ran = run_pipeline(stages, only=args.stages, force=args.force, dry_run=args.dry_run)
+    if not args.dry_run:
+        print(f"[pipeline] ran {', '.join(ran) if ran else 'nothing, everything was up to date'}")
@@ -4,19 +4,22 @@ Reads text message data and extracts statistics/information I want to display:
 - Various links sent, to find common websites I've linked in text messages
 """
 
-import re
-import csv
-import json
-import spacy
-import string
+import argparse
 import pandas as pd
 
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
 from collections import Counter
-from urllib.parse import urlparse
 
 from utils import *
+from storage import FORMATS, default_format, read_table
+from parallel import SHARD_BY, merge_group_counts
+from cube import build_cube, rollup, save_cube, load_cube
+from links import extract_links, save_link_files, link_interner
+from contacts import load_contact_index, build_contact_index, resolve_handles, contact_index_hash
+from frame import compact_messages, first_names, with_date_parts, memory_report
+from instrument import start_run, stage, finish_run
+from hierarchy import year_nodes, write_hierarchy
+from distinctive import METHODS, distinctive_words
+from search_index import index_last_rowid, search, count_messages, links_query
 
 pd.set_option('display.max_columns', None)
 
@@ -28,141 +31,268 @@ dtypes = {
     "phone_number": str,
 }
 
-contacts = pd.read_csv("data/contacts.csv").drop(columns=["Z_PK_x", "Z_PK_y"])
-msgs = pd.read_csv("data/messages.csv", dtype=dtypes).drop(columns=["chat_id", "handle_id"])
+group_keys = ['year', 'first_name', 'is_from_me']
+# the message columns used here (chat_id and handle_id aren't loaded)
+message_columns = ["text", "date", "message_id", "is_from_me", "is_emote", "is_audio_message", "phone_number"]
 
-contacts['first_name'] = contacts['name'].str.split().str[0].str.split('-').str[0]
 
-print(len(contacts))
-print(len(msgs))
+def load_index(fmt=default_format):
+    """
+    The handle -> contact lookup index saved by get_parse_data.py
+    """
+    index = load_contact_index()
+    if index is None:
+        # older data folders only have the contacts table
+        contacts = read_table("contacts", fmt, columns=["name", "phone_number"], dtype={"phone_number": str})
+        index = build_contact_index(contacts)
+    return index
+
+
+def load_messages(fmt=default_format, index=None):
+    """
+    Read the messages saved by get_parse_data.py and look up the contact each one is with
+    (in index, loaded with load_index if it isn't passed in)
+    """
+    with stage(f"read messages ({fmt})") as record:
+        msgs = read_table("messages", fmt, columns=message_columns, dtype=dtypes)
+        if fmt == "parquet":
+            # the flags are saved as the 0/1 integers from the database
+            msgs = msgs.astype({column: bool for column, dtype in dtypes.items() if dtype is bool})
+        record["rows_out"] = len(msgs)
 
-df = pd.merge(msgs, contacts, how="inner")
+    if index is None:
+        index = load_index(fmt)
+    print(len(index["numbers"]) + len(index["emails"]))
+    print(len(msgs))
 
-# Convert 'date' column to datetime
-df['date'] = pd.to_datetime(df['date'])
+    # messages from handles that aren't in the contacts are dropped (like the inner join used to)
+    with stage("resolve contacts", rows_in=len(msgs)) as record:
+        msgs['name'] = resolve_handles(msgs['phone_number'], index)
+        df = msgs[msgs['name'].notna()].reset_index(drop=True)
+        record["rows_out"] = len(df)
+    memory_report("load", df)
 
-# Extract year, month, day, and time components
-df['year'] = df['date'].dt.year
-df['month'] = df['date'].dt.month
-df['day'] = df['date'].dt.day
-df['time'] = df['date'].dt.time.astype(str)
+    with stage("compact messages", rows_in=len(df)) as record:
+        # Convert 'date' column to datetime (already a datetime when read from parquet)
+        df['date'] = pd.to_datetime(df['date'])
 
-print(df.head())
+        # contact fields are dictionary encoded and year/month/day are added by the stages that group on them
+        df = compact_messages(df)
+        df['first_name'] = first_names(df['name'])
+        record["rows_out"] = len(df)
+    memory_report("compact", df)
 
+    print(df.head())
+    return df
 
-def text_counter(df, remove_common_words=False):
+
+def text_counter(df, remove_common_words=False, groups=None, group_stats=None, gzip_output=False, year_shards=False,
+                 distinctive=None, print_stats=True):
     """
     Group a dataframe and count common words and emojis for text groupings
     This counts by year, and then by conversation/person
     Saves the stats to a JSON file to be used by the d3 functions in the sketch
+    groups (rolled up to group_keys) and group_stats (from cube_group_stats) can be passed in
+    to reuse counts from an already built cube
+    print_stats=False only saves the file (e.g. when the stats were already printed for the other file)
     """
 
-    # Group by year and count texts
-    yearly_counts = df.groupby('year').size()
-    print("\nTexts sent per year:")
-    print(yearly_counts)
-
-    # Group by year and month and count texts
-    monthly_counts = df.groupby(['year', 'month']).size()
-    print("\nTexts sent per year and month:")
-    print(monthly_counts)
-
-    # Group by year, name, and sent/received and count texts
-    grouped_counts = df.groupby(['year', 'first_name', 'is_from_me']).size()
-    print("\nTexts sent and received per year and person:")
-    print(grouped_counts)
-
-    is_from_me = {
-        1: "Sent", 0: "Received"
-    }
-    
-    # Convert daily_counts Series to nested dictionary with name/value objects
-    # Hierarchy: Years > Names > Sent/Received
-    nested_counts = []
-    total_value = 0
-    for year, people in grouped_counts.groupby(level=0):
-        year_obj = {"name": str(year), "children": [], "value": 0}
-        for person, sent_received in people.groupby(level=1):
-            person_obj = {"name": person, "children": [], "value": 0}
-            for (y, p, sent), count in sent_received.items():
-                selected_info = df[((df["year"] == year) & (df["first_name"] == person) & (df["is_from_me"] == sent))]
-                common_words = most_common_words(selected_info["text"], remove_common_words=remove_common_words)
-                common_emoji = most_common_emoji(selected_info["text"])
-                sent_received_obj = {"name": is_from_me[sent],
-                                     "value": int(count),
-                                     "common_words": common_words,
-                                     "common_emoji": common_emoji}
-                person_obj["children"].append(sent_received_obj)
-                person_obj["value"] += int(count)
-            year_obj["children"].append(person_obj)
-            year_obj["value"] += person_obj["value"]
-        nested_counts.append(year_obj)
-        total_value += year_obj["value"]
-    
-    # Save nested_counts to JSON file
+    df = with_date_parts(df, ['year', 'month'])
+
+    if print_stats:
+        # Group by year and count texts
+        yearly_counts = df.groupby('year').size()
+        print("\nTexts sent per year:")
+        print(yearly_counts)
+
+        # Group by year and month and count texts
+        monthly_counts = df.groupby(['year', 'month']).size()
+        print("\nTexts sent per year and month:")
+        print(monthly_counts)
+
+        # Group by year, name, and sent/received and count texts
+        grouped_counts = df.groupby(['year', 'first_name', 'is_from_me'], observed=True).size()
+        print("\nTexts sent and received per year and person:")
+        print(grouped_counts)
+
+    # Word and emoji counts are rolled up from the per-day cube (built here if they weren't passed in)
+    if groups is None or (group_stats is None and print_stats):
+        cube = build_cube(df)
+        groups = rollup(cube, group_keys) if groups is None else groups
+        group_stats = cube_group_stats(cube) if group_stats is None else group_stats
+
+    write_text_counts(groups, remove_common_words=remove_common_words, gzip_output=gzip_output, year_shards=year_shards,
+                      distinctive=distinctive)
+
+    # stats by year, by year and month (and by year, month and day)
+    if print_stats:
+        for group_name, stats_groups in group_stats.items():
+            print_counter_stats(stats_groups, group_name)
+
+
+def cube_group_stats(cube, daily=False):
+    """
+    Word/emoji counts by year and year-month (and year-month-day with daily), rolled up from the cube
+    """
+    stats = {"year": rollup(cube, ['year']),
+             "year-month": rollup(cube, ['year', 'month'])}
+    if daily:
+        stats["year-month-day"] = rollup(cube, ['year', 'month', 'day'])
+    return stats
+
+
+def write_text_counts(groups, remove_common_words=False, gzip_output=False, year_shards=False, distinctive=None):
+    """
+    Turn the (year, first_name, is_from_me) group counters into the nested year > person > sent/received
+    hierarchy and save it to the JSON file used by the d3 functions in the sketch (one year at a time)
+    With distinctive ("log-odds" or "tfidf") the words listed for each group are the most distinctive ones
+    for that person/year/direction instead of the most common
+    """
     if remove_common_words:
         file_name = "data/text_counts_no_common_words.json"
     else:
         file_name = "data/text_counts.json"
-    with open(file_name, "w") as f:
-        json.dump({"name": "lifetime", "children": nested_counts, "value": total_value}, f, indent=4)
-        
-    # Group by year and get stats
-    yearly_groups = df.groupby('year')
-    print_group_stats(yearly_groups, "year")
-    
-    # Group by year and month and get stats
-    monthly_groups = df.groupby(['year', 'month'])
-    print_group_stats(monthly_groups, "year-month")
-    
-    # Group by year, month, and day and get stats
-    daily_groups = df.groupby(['year', 'month', 'day'])
-    # print_group_stats(daily_groups, "year-month-day")
-
-
-text_counter(df)
-text_counter(df, remove_common_words=True)
-
-print(f"{'=' * 20}")
-
-df = df[df['is_from_me'] == 1] # only look at texts i've sent
-
-overall_common_word = most_common_words(df['text'], get_all=True)
-overall_common_emoji = most_common_emoji(df['text'])
-print(f"most_common_words={overall_common_word}, most_common_emoji={overall_common_emoji}")
-
-# df_links = df[df['text'].str.contains('link_pattern, na=False, case=False, regex=True')]
-df_links = df[df['text'].str.contains('http')]
-print(len(df_links))
-
-spotify_df = df[df['text'].str.contains('open.spotify.com')]
-spotify_df[['text']].to_csv("data/spotify_linked.csv", index=False)
-
-youtube_df = df[df['text'].str.contains('youtu.be') | df['text'].str.contains('youtube.com')]
-youtube_df[['text']].to_csv("data/youtube_linked.csv", index=False)
-
-# Print the value counts of the base URLs in the text messages that are links
-print("\nValue counts of base URLs in text messages that are links:")
-
-def get_base_url(url):
-    for word in imsg_reaction_words:
-        if word in url.lower():
-            return '' # it's just a reaction to a url, not a url that i sent
-    try:
-        parsed_url = urlparse(url)
-        return parsed_url.netloc.replace('www.', '')
-    except Exception:
-        return url  # fallback to original if parsing fails
-
-base_urls = df_links['text'].apply(get_base_url)
-counts = base_urls.value_counts()
-print(counts)
-
-# Filter out base URLs with count of 1
-filtered_counts = counts[counts > 1]
-
-# Save to CSV
-filtered_counts_df = filtered_counts.reset_index()
-filtered_counts_df.columns = ['base_url', 'count']
-filtered_counts_df = filtered_counts_df[filtered_counts_df['base_url'] != '']
-filtered_counts_df.to_csv("data/websites_linked.csv", index=False)
+    common_words = None
+    if distinctive is not None:
+        with stage(f"distinctive words ({distinctive})", rows_in=len(groups)):
+            common_words = distinctive_words(groups, method=distinctive, remove_common_words=remove_common_words)
+    write_hierarchy(year_nodes(groups, remove_common_words=remove_common_words, common_words=common_words),
+                    file_name, gzip_output=gzip_output, year_shards=year_shards)
+
+
+def indexed_link_texts(df):
+    """
+    The texts of the messages in df (the ones I've sent to contacts) that have a link, looked up in the
+    full-text index of data/messages.db instead of scanning every text
+    None if there's no index or it doesn't have the same messages as df
+    """
+    if index_last_rowid() is None:
+        return None
+    rows, last_message_id = count_messages(is_from_me=True, contacts_only=True)
+    if rows != len(df) or (rows and last_message_id != df['message_id'].max()):
+        print("data/messages.db doesn't match data/messages, run get_parse_data.py --search-index to update it")
+        return None
+    return search(links_query(), is_from_me=True, contacts_only=True, columns=["text"])['text']
+
+
+def link_stats(df, search_index=False):
+    """
+    Find links in the texts I've sent and save the spotify/youtube links and common websites to CSVs
+    With search_index only the messages the index finds with a link are searched for links
+    """
+    texts = df['text']
+    if search_index:
+        with stage("search index link lookup", rows_in=len(df)) as record:
+            indexed = indexed_link_texts(df)
+            record["rows_out"] = None if indexed is None else len(indexed)
+        if indexed is not None:
+            texts = indexed
+    with stage("extract links", rows_in=len(texts)) as record:
+        links = extract_links(texts)
+        record["rows_out"] = len(links)
+    print(f"{links['message'].nunique()} messages with {len(links)} links")
+
+    # Print the number of messages linking to each website
+    print("\nNumber of text messages linking to each website:")
+    with stage("write link csvs", rows_in=len(links)):
+        save_link_files(links)
+
+
+def main(incremental=False, fmt=default_format, workers=1, shard_by="year", profile=False, gzip_output=False,
+         year_shards=False, distinctive=None, search_index=False, daily_stats=False):
+    start_run("prepare_data", profile=profile)
+    index = load_index(fmt)
+    df = load_messages(fmt, index)
+    last_message_id = int(df['message_id'].max()) if len(df) else 0
+
+    # the saved counts can't be reused once the contacts changed (a new contact, a rename, ...)
+    contacts = contact_index_hash(index)
+    saved = load_cube(contacts=contacts) if incremental else None
+    if incremental and saved is None:
+        print("No saved text counts for these contacts, counting every message")
+    if saved is not None:
+        # only tokenize messages that are newer than the last run and merge them into the saved cube
+        cube, saved_message_id = saved
+        new_df = df[df['message_id'] > saved_message_id]
+        print(f"Merging {len(new_df)} new messages into the saved text counts")
+        with stage("count words/emoji (cube)", rows_in=len(new_df)) as record:
+            new_cube = build_cube(new_df, workers, shard_by)
+            record["rows_out"] = len(new_cube)
+        with stage("merge cube", rows_in=len(new_cube)) as record:
+            merge_group_counts(cube, new_cube)
+            record["rows_out"] = len(cube)
+        last_message_id = max(last_message_id, saved_message_id)
+        # only the years with new messages are written again
+        changed_years = {cell_key[0] for cell_key in new_cube}
+    else:
+        # per day/person/sent counts for every message, everything else is rolled up from these
+        with stage("count words/emoji (cube)", rows_in=len(df)) as record:
+            cube = build_cube(df, workers, shard_by)
+            record["rows_out"] = len(cube)
+        changed_years = None
+    with stage("write cube json", rows_in=len(cube)):
+        save_cube(cube, last_message_id, years=changed_years, contacts=contacts)
+    memory_report("count", df)
+
+    with stage("roll up cube", rows_in=len(cube)) as record:
+        groups = rollup(cube, group_keys)
+        group_stats = cube_group_stats(cube, daily=daily_stats) if saved is None else None
+        record["rows_out"] = len(groups)
+    if saved is not None:
+        write_text_counts(groups, gzip_output=gzip_output, year_shards=year_shards, distinctive=distinctive)
+        write_text_counts(groups, remove_common_words=True, gzip_output=gzip_output, year_shards=year_shards,
+                          distinctive=distinctive)
+    else:
+        with stage("text_counter", rows_in=len(df)):
+            text_counter(df, groups=groups, group_stats=group_stats, gzip_output=gzip_output, year_shards=year_shards,
+                         distinctive=distinctive)
+            # same stats as the first call, so they're only printed once
+            text_counter(df, remove_common_words=True, groups=groups, group_stats=group_stats,
+                         gzip_output=gzip_output, year_shards=year_shards, distinctive=distinctive,
+                         print_stats=False)
+
+    print(f"{'=' * 20}")
+
+    if saved is None:
+        with stage("most_common_words"):
+            sent = rollup(cube, ['is_from_me']).get((True,), {"words": Counter(), "emoji": Counter()})
+            overall_common_word = top_words(sent["words"], n=100)
+            overall_common_emoji = top_emoji(sent["emoji"])
+        print(f"most_common_words={overall_common_word}, most_common_emoji={overall_common_emoji}")
+
+    df = df[df['is_from_me'] == 1] # only look at texts i've sent
+
+    link_stats(df, search_index=search_index)
+    memory_report("links", df)
+    # how much repeated text the words/emoji counting and link search got to skip
+    text_interner.report("interning words/emoji")
+    link_interner.report("interning links")
+    finish_run()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract text statistics and links from data/messages")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only count messages newer than the last run and merge them into the saved text counts")
+    parser.add_argument("--format", choices=FORMATS, default=default_format,
+                        help="file format get_parse_data.py saved data/messages and data/contacts in")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes to count words/emoji with (1 runs everything in this process)")
+    parser.add_argument("--shard-by", choices=SHARD_BY, default="year",
+                        help="how messages are split between the worker processes")
+    parser.add_argument("--profile", action="store_true",
+                        help="run each stage under cProfile and save the slowest stage's profile to data/")
+    parser.add_argument("--gzip", action="store_true",
+                        help="also save gzip compressed copies of the chart JSON files (.json.gz)")
+    parser.add_argument("--year-shards", action="store_true",
+                        help="also save the chart data as one file per year (data/text_counts/<year>.json)")
+    parser.add_argument("--distinctive", choices=METHODS,
+                        help="list each group's most distinctive words (instead of its most common) in the chart data")
+    parser.add_argument("--search-index", action="store_true",
+                        help="find the messages with links through data/messages.db (get_parse_data.py --search-index)")
+    parser.add_argument("--daily-stats", action="store_true",
+                        help="also print the word/emoji stats for every day (year-month-day)")
+    args = parser.parse_args()
+    main(incremental=args.incremental, fmt=args.format, workers=args.workers, shard_by=args.shard_by,
+         profile=args.profile, gzip_output=args.gzip, year_shards=args.year_shards, distinctive=args.distinctive,
+         search_index=args.search_index, daily_stats=args.daily_stats)
@@ -0,0 +1,226 @@
+"""
+A local sqlite copy of the extracted messages (data/messages.db) with an FTS5 full-text index on the text
+and b-tree indexes on date, contact and is_from_me, so questions like "which messages mention X" or
+"links from person Y in 2023" are indexed lookups instead of pandas str.contains scans over every message
+
+get_parse_data.py --search-index builds it (and with --incremental appends the new messages to it),
+then from python:
+
+    search("pizza")                                     # keyword (any FTS5 query: pizza OR tacos, piz*, ...)
+    search(phrase("see you soon"), name="Alex Smith")   # exact phrase with one person
+    search(links_query(), is_from_me=True, start="2023-01-01", end="2024-01-01")
+
+or from the command line: python3 search_index.py pizza --name "Alex Smith" --year 2023 --sent
+"""
+
+import os
+import time
+import sqlite3
+import argparse
+import pandas as pd
+
+search_db_path = "data/messages.db"
+
+schema = """
+    create table if not exists messages (
+        id integer primary key,  -- insertion order, same as the rows of data/messages
+        message_id integer,      -- ROWID in chat.db (a message in more than one chat has a row for each)
+        text text,
+        date text,               -- 'YYYY-MM-DD HH:MM:SS' pacific time, so ranges compare as strings
+        name text,               -- contact the message is with (null if the handle isn't in the contacts)
+        phone_number text,
+        chat_id integer,
+        is_from_me integer,
+        is_emote integer,
+        is_audio_message integer
+    );
+    create index if not exists messages_date on messages(date);
+    create index if not exists messages_name on messages(name, date);
+    create index if not exists messages_is_from_me on messages(is_from_me, date);
+    create index if not exists messages_message_id on messages(message_id);
+
+    -- external content table: the index only stores the tokens, the text stays in messages
+    -- unicode61 splits on punctuation too, so a url is indexed as its parts (https, open, spotify, com, ...)
+    create virtual table if not exists messages_fts using fts5(
+        text, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    );
+    -- new rows are added to the index a chunk at a time by SearchIndex.add (a trigger per row is ~3x slower),
+    -- these keep it right if messages are edited or deleted
+    create trigger if not exists messages_delete after delete on messages begin
+        insert into messages_fts(messages_fts, rowid, text) values ('delete', old.id, old.text);
+    end;
+    create trigger if not exists messages_update after update of text on messages begin
+        insert into messages_fts(messages_fts, rowid, text) values ('delete', old.id, old.text);
+        insert into messages_fts(rowid, text) values (new.id, new.text);
+    end;
+
+    create table if not exists state (key text primary key, value integer);
+"""
+
+insert_columns = ["message_id", "text", "date", "name", "phone_number", "chat_id", "is_from_me", "is_emote",
+                  "is_audio_message"]
+result_columns = ["message_id", "date", "name", "phone_number", "is_from_me", "text"]
+
+
+class SearchIndex:
+    """
+    Adds message chunks (from get_parse_data.read_messages, with a name column) to the search database
+    With append=False the database is rebuilt from scratch
+    """
+
+    def __init__(self, path=search_db_path, append=False):
+        if not append:
+            for file_path in [path, path + "-wal", path + "-shm"]:
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(schema)
+        self.rows = 0
+
+    def add(self, df):
+        rows = df.assign(date=df["date"].dt.strftime("%Y-%m-%d %H:%M:%S"))[insert_columns]
+        rows = rows.astype(object).where(rows.notna(), None)
+        with self.conn:
+            last_id = self.conn.execute("select coalesce(max(id), 0) from messages").fetchone()[0]
+            self.conn.executemany(f"insert into messages ({', '.join(insert_columns)}) "
+                                  f"values ({', '.join('?' * len(insert_columns))})",
+                                  rows.itertuples(index=False, name=None))
+            self.conn.execute("insert into messages_fts(rowid, text) select id, text from messages where id > ?",
+                              (last_id,))
+        self.rows += len(rows)
+
+    def finish(self, last_rowid):
+        # the last chat.db ROWID the index has seen, for the next incremental run
+        with self.conn:
+            self.conn.execute("insert or replace into state values ('last_rowid', ?)", (int(last_rowid),))
+        self.conn.execute("insert into messages_fts(messages_fts) values ('optimize')")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def index_last_rowid(path=search_db_path):
+    """
+    Last chat.db ROWID in the search database, None if it hasn't been built
+    """
+    if not os.path.exists(path):
+        return None
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        row = conn.execute("select value from state where key = 'last_rowid'").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+
+def phrase(text):
+    # an FTS5 phrase: the words in this order (quotes inside are doubled)
+    return '"' + text.replace('"', '""') + '"'
+
+
+def links_query(domain=None):
+    """
+    FTS5 query for messages with a link (to domain, e.g. "open.spotify.com")
+    Only narrows down the messages, links.extract_links still pulls out the actual urls
+    """
+    if domain is None:
+        return "http*"
+    return "http* AND " + phrase(" ".join(domain.split(".")))
+
+
+def where_clause(query=None, name=None, is_from_me=None, start=None, end=None, contacts_only=False):
+    """
+    The from/where part of a lookup and its parameters
+    """
+    where, params = [], []
+    table = "messages m"
+    if query is not None:
+        table += " join messages_fts f on f.rowid = m.id"
+        where.append("messages_fts match ?")
+        params.append(query)
+    if name is not None:
+        where.append("m.name = ?")
+        params.append(name)
+    elif contacts_only:
+        where.append("m.name is not null")
+    if is_from_me is not None:
+        where.append("m.is_from_me = ?")
+        params.append(int(is_from_me))
+    if start is not None:
+        where.append("m.date >= ?")
+        params.append(str(start))
+    if end is not None:
+        where.append("m.date < ?")
+        params.append(str(end))
+    return f"from {table}" + (" where " + " and ".join(where) if where else ""), params
+
+
+def read_query(sql, params, path=search_db_path, index_col=None):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return pd.read_sql_query(sql, conn, params=params, index_col=index_col)
+    finally:
+        conn.close()
+
+
+def search(query=None, name=None, is_from_me=None, start=None, end=None, contacts_only=False, limit=None,
+           columns=result_columns, path=search_db_path):
+    """
+    Find messages matching an FTS5 query (keyword, phrase(...), prefix*, AND/OR/NOT, NEAR(...))
+    and/or the filters: name (contact), is_from_me, start <= date < end ("2023" or "2023-06-01" also work)
+    contacts_only leaves out messages from handles that aren't in the contacts
+    Returns a dataframe (indexed by row id) in the order the messages were extracted,
+    or most relevant first with a query and a limit
+    """
+    where, params = where_clause(query, name, is_from_me, start, end, contacts_only)
+    sql = f"select m.id, {', '.join('m.' + column for column in columns)} {where}"
+    # bm25 rank is only worth computing when not every match is returned
+    sql += " order by f.rank" if query is not None and limit is not None else " order by m.id"
+    if limit is not None:
+        sql += f" limit {int(limit)}"
+    return read_query(sql, params, path, index_col="id")
+
+
+def count_messages(query=None, name=None, is_from_me=None, start=None, end=None, contacts_only=False,
+                   path=search_db_path):
+    """
+    Number of messages and the highest chat.db ROWID out of the ones search would find
+    """
+    where, params = where_clause(query, name, is_from_me, start, end, contacts_only)
+    counts = read_query(f"select count(*), max(m.message_id) {where}", params, path)
+    return int(counts.iloc[0, 0]), counts.iloc[0, 1]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search the messages in data/messages.db (get_parse_data.py --search-index)")
+    parser.add_argument("query", nargs="?", help="FTS5 query, e.g. pizza, \"pizza OR tacos\", piz*")
+    parser.add_argument("--phrase", help="match this exact phrase instead")
+    parser.add_argument("--name", help="only messages with this contact")
+    parser.add_argument("--year", type=int, help="only messages from this year")
+    parser.add_argument("--sent", action="store_true", help="only messages I sent")
+    parser.add_argument("--received", action="store_true", help="only messages I received")
+    parser.add_argument("--links", nargs="?", const="", help="only messages with a link (to this domain)")
+    parser.add_argument("--limit", type=int, default=20, help="number of (most relevant) messages to show")
+    args = parser.parse_args()
+
+    query = phrase(args.phrase) if args.phrase else args.query
+    if args.links is not None:
+        links = links_query(args.links or None)
+        query = f"({query}) AND {links}" if query else links
+    is_from_me = True if args.sent else False if args.received else None
+    start, end = (str(args.year), str(args.year + 1)) if args.year else (None, None)
+
+    started = time.perf_counter()
+    results = search(query, name=args.name, is_from_me=is_from_me, start=start, end=end, limit=args.limit)
+    print(results.to_string(index=False, max_colwidth=80))
+    print(f"{len(results)} messages in {(time.perf_counter() - started) * 1000:.1f} ms")
@@ -64,6 +64,39 @@ function setupSentReceivedLegend() {
   document.body.appendChild(legendContainer);
 }
 
+/**
+ * Fetches a JSON file, decompressing it first if it is a precompressed .json.gz file.
+ * @param {string} url - URL of the .json or .json.gz file.
+ * @returns {Promise<Object>} The parsed JSON.
+ */
+async function fetchJson(url) {
+  const response = await fetch(url);
+  if (!url.endsWith(".gz")) {
+    return response.json();
+  }
+  const stream = response.body.pipeThrough(new DecompressionStream("gzip"));
+  return new Response(stream).json();
+}
+
+/**
+ * Loads the year > person > sent/received hierarchy for the chart.
+ * The URL can be a single file (data/text_counts.json) or the index of the per-year
+ * files written by prepare_data.py --year-shards (data/text_counts/index.json),
+ * in which case the years are downloaded in parallel and put back together.
+ * @param {string} dataUrl - URL of the hierarchy JSON file or the per-year index.
+ * @returns {Promise<Object>} The hierarchy with the years as children of the root.
+ */
+async function loadHierarchy(dataUrl) {
+  const data = await fetchJson(dataUrl);
+  if (!data.shards) {
+    return data;
+  }
+  const baseUrl = dataUrl.slice(0, dataUrl.lastIndexOf("/") + 1);
+  const suffix = dataUrl.endsWith(".gz") ? ".gz" : "";
+  const children = await Promise.all(data.shards.map(shard => fetchJson(baseUrl + shard.url + suffix)));
+  return { name: data.name, children, value: data.value };
+}
+
 /**
  * Creates a packed circle chart visualization of message counts data.
  * The chart shows hierarchical data with years, persons, and sent/received counts.
@@ -75,8 +108,7 @@ function setupSentReceivedLegend() {
  */
 async function createChart(dataUrl = "data/text_counts.json") {
 
-  const response = await fetch(dataUrl);
-  const data = await response.json();
+  const data = await loadHierarchy(dataUrl);
 
   // Specify the chart’s dimensions.
   const width = 1000;
@@ -3,31 +3,29 @@ Given a list of Spotify track links, queries the Spotify API to get track inform
 Finds and saves the artists and the counts of how many songs per artist were linked
 """
 
+import os
+import re
+import json
+import time
 import spotipy
 import pandas as pd
 
+from concurrent.futures import ThreadPoolExecutor
 from spotipy.oauth2 import SpotifyClientCredentials, SpotifyOAuth
 
-from config import CLIENT_ID, CLIENT_SECRET
+max_ids_per_request = 50 # sp.tracks accepts up to 50 track IDs
+max_retries = 5
+# spotify IDs are 22 base62 characters, anything else (e.g. trailing junk from a link) makes sp.tracks reject the batch
+track_id_pattern = re.compile(r"[0-9A-Za-z]{22}")
 
-spotify_links = pd.read_csv("data/spotify_linked.csv")
+# track ID -> artist names from previous runs, so each run only looks up new tracks
+track_cache_path = "data/spotify_track_cache.json"
 
 # Filter to keep only Spotify track links (exclude playlists and others)
 def is_track_link(link):
     # Spotify track links have the format: https://open.spotify.com/track/{track_id}
     return "open.spotify.com/track/" in link
 
-track_links = spotify_links['text'].dropna().unique()
-track_links = [link for link in track_links if is_track_link(link)]
-
-print(f"Found {len(track_links)} track links")
-
-
-sp = spotipy.Spotify(auth_manager=SpotifyOAuth(client_id=CLIENT_ID,
-                                                           client_secret=CLIENT_SECRET,
-                                                           redirect_uri="http://127.0.0.1:8000",
-                                                        scope="user-library-read"))
-
 # Function to extract track ID from Spotify track URL
 def extract_track_id(url):
     # URL format: https://open.spotify.com/track/{track_id}
@@ -37,32 +35,138 @@ def extract_track_id(url):
         return track_id
     return None
 
-# Query Spotify API for each track and collect artist names
-artist_counts = {}
-
-for link in track_links:
-    track_id = extract_track_id(link)
-    if not track_id:
-        continue
+def make_client():
+    # the credentials are only needed (and config.py only has to exist) to talk to the real API
+    from config import CLIENT_ID, CLIENT_SECRET
+    return spotipy.Spotify(auth_manager=SpotifyOAuth(client_id=CLIENT_ID,
+                                                     client_secret=CLIENT_SECRET,
+                                                     redirect_uri="http://127.0.0.1:8000",
+                                                     scope="user-library-read"))
+
+def load_track_cache(cache_path=track_cache_path):
+    """
+    Load the saved track ID -> artist names mapping (None means spotify didn't find the track)
+    """
+    if not os.path.exists(cache_path):
+        return {}
+    with open(cache_path) as f:
+        return json.load(f)
+
+def save_track_cache(cache, cache_path=track_cache_path):
+    with open(cache_path, "w") as f:
+        json.dump(cache, f)
+
+def call_with_retries(request):
+    """
+    Make a spotify request, waiting and retrying when spotify rate limits us (HTTP 429), using its Retry-After header
+    Other errors (and the last 429) are raised
+    """
+    for attempt in range(max_retries):
+        try:
+            return request()
+        except spotipy.SpotifyException as e:
+            if e.http_status != 429 or attempt == max_retries - 1:
+                raise
+            retry_after = (e.headers or {}).get("Retry-After")
+            time.sleep(int(retry_after) if retry_after else 2 ** attempt)
+
+def is_rejected(error):
+    # spotify turned down the request itself (4xx other than rate limiting), asking again won't help
+    status = getattr(error, "http_status", None) or 0
+    return 400 <= status < 500 and status != 429
+
+def artist_names(track):
+    return [artist['name'] for artist in track['artists']] if track else None
+
+def fetch_track_artists(sp, track_ids):
+    """
+    Get the artist names for up to 50 tracks with one sp.tracks call
+    If spotify rejects the whole batch, the tracks are looked up one at a time so one bad ID doesn't hold up the rest
+    Returns {track_id: [artist names]} (None for tracks spotify doesn't know or rejects), leaving out tracks
+    that failed for other reasons (so they are tried again next run), or None if the whole lookup failed that way
+    """
     try:
-        track = sp.track(track_id)
-        artists = track['artists']
-        for artist in artists:
-            name = artist['name']
-            artist_counts[name] = artist_counts.get(name, 0) + 1
+        tracks = call_with_retries(lambda: sp.tracks(track_ids)['tracks'])
+        return {track_id: artist_names(track) for track_id, track in zip(track_ids, tracks)}
     except Exception as e:
-        print(f"Error fetching track {track_id}: {e}")
-
-print(f"Processed {len(track_links)} tracks")
+        print(f"Error fetching tracks {track_ids}: {e}")
+        if not is_rejected(e):
+            return None
+
+    artists = {}
+    for track_id in track_ids:
+        try:
+            artists[track_id] = artist_names(call_with_retries(lambda: sp.track(track_id)))
+        except Exception as e:
+            print(f"Error fetching track {track_id}: {e}")
+            if is_rejected(e):
+                artists[track_id] = None
+    return artists
+
+def resolve_track_artists(sp, track_ids, cache, max_workers=4):
+    """
+    Look up the (deduplicated) track IDs that aren't cached yet, in batches of 50 with up to
+    max_workers requests in flight at once, and add the results to the cache
+    IDs that can't be spotify IDs are cached as unknown without asking spotify
+    """
+    missing = [track_id for track_id in dict.fromkeys(track_ids) if track_id and track_id not in cache]
+    invalid = [track_id for track_id in missing if not track_id_pattern.fullmatch(track_id)]
+    cache.update(dict.fromkeys(invalid))
+    missing = [track_id for track_id in missing if track_id_pattern.fullmatch(track_id)]
+    print(f"{len(missing)} tracks to look up ({len(cache)} cached, {len(invalid)} invalid IDs skipped)")
+    if not missing:
+        return cache
+
+    # get the token before the threads start, otherwise each of them can start its own OAuth login
+    auth_manager = getattr(sp, "auth_manager", None)
+    if auth_manager is not None:
+        auth_manager.get_access_token(as_dict=False)
+
+    batches = [missing[i:i + max_ids_per_request] for i in range(0, len(missing), max_ids_per_request)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for artists in executor.map(lambda batch: fetch_track_artists(sp, batch), batches):
+            if artists is not None:
+                cache.update(artists)
+    return cache
+
+def count_artists(track_links, cache):
+    """
+    Count how many of the linked tracks each artist is on, using the cached track artists
+    """
+    artist_counts = {}
+    for link in track_links:
+        for name in cache.get(extract_track_id(link)) or []:
+            artist_counts[name] = artist_counts.get(name, 0) + 1
+    return artist_counts
 
-# Print artist counts sorted by frequency descending
-print("\nArtist counts across linked tracks:")
-artists = []
-for artist, count in sorted(artist_counts.items(), key=lambda x: x[1], reverse=True):
-    print(f"{artist}: {count}")
-    artists.append([artist, count])
+def main(sp=None, cache_path=track_cache_path, max_workers=4):
+    spotify_links = pd.read_csv("data/spotify_linked.csv")
 
-artists_df = pd.DataFrame(artists, columns=['artist', 'count'])
-artists_df.to_csv("data/spotify_artists.csv",index=False)
+    track_links = spotify_links['text'].dropna().unique()
+    track_links = [link for link in track_links if is_track_link(link)]
 
+    print(f"Found {len(track_links)} track links")
 
+    # Query Spotify API for the tracks we haven't seen before and collect artist names
+    cache = load_track_cache(cache_path)
+    try:
+        resolve_track_artists(sp or make_client(), [extract_track_id(link) for link in track_links],
+                              cache, max_workers=max_workers)
+    finally:
+        save_track_cache(cache, cache_path)
+    artist_counts = count_artists(track_links, cache)
+
+    print(f"Processed {len(track_links)} tracks")
+
+    # Print artist counts sorted by frequency descending
+    print("\nArtist counts across linked tracks:")
+    artists = []
+    for artist, count in sorted(artist_counts.items(), key=lambda x: x[1], reverse=True):
+        print(f"{artist}: {count}")
+        artists.append([artist, count])
+
+    artists_df = pd.DataFrame(artists, columns=['artist', 'count'])
+    artists_df.to_csv("data/spotify_artists.csv",index=False)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Read and write the intermediate tables passed between the scripts (data/messages, data/contacts)
+Parquet keeps typed, compressed columns and native datetimes so nothing has to be re-parsed,
+CSV is still available (and is the fallback when pyarrow isn't installed)
+"""
+
+import os
+import csv
+import shutil
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+FORMATS = ["parquet", "csv"]
+default_format = "parquet" if pq is not None else "csv"
+data_dir = "data"
+
+
+def table_path(name, fmt):
+    # parquet tables are a directory of part files so new rows can be appended as another part
+    return os.path.join(data_dir, f"{name}.{fmt}")
+
+
+def check_format(fmt):
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown table format {fmt!r}, expected one of {FORMATS}")
+    if fmt == "parquet" and pq is None:
+        raise ImportError("pyarrow is needed for the parquet format (python3 -m pip install pyarrow), or use --format csv")
+
+
+class TableWriter:
+    """
+    Writes a table one chunk (dataframe) at a time
+    With append=True the chunks are added after the rows already saved for the table
+    """
+
+    def __init__(self, name, fmt=default_format, append=False):
+        check_format(fmt)
+        self.path = table_path(name, fmt)
+        self.fmt = fmt
+        self.append = append and os.path.exists(self.path)
+        self.rows = 0
+        self._writer = None
+        self._schema = None
+
+        if not self.append:
+            if os.path.isdir(self.path):
+                shutil.rmtree(self.path)
+            elif os.path.exists(self.path):
+                os.remove(self.path)
+        if fmt == "parquet":
+            os.makedirs(self.path, exist_ok=True)
+            part = len([f for f in os.listdir(self.path) if f.endswith(".parquet")])
+            self._part_path = os.path.join(self.path, f"part-{part:05d}.parquet")
+
+    def write(self, df):
+        if self.fmt == "csv":
+            header = self.rows == 0 and not self.append
+            df.to_csv(self.path, mode="w" if header else "a", header=header, index=False, quoting=csv.QUOTE_ALL)
+        else:
+            if self._writer is None:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                self._schema = table.schema
+                self._writer = pq.ParquetWriter(self._part_path, self._schema, compression="zstd")
+            else:
+                table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+            self._writer.write_table(table)
+        self.rows += len(df)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_table(df, name, fmt=default_format, append=False):
+    with TableWriter(name, fmt, append=append) as writer:
+        writer.write(df)
+
+
+def read_table(name, fmt=default_format, columns=None, dtype=None):
+    """
+    Read a saved table, only loading the given columns
+    dtype is only needed for CSV, parquet already stores the column types
+    """
+    check_format(fmt)
+    path = table_path(name, fmt)
+    if fmt == "csv":
+        return pd.read_csv(path, usecols=columns, dtype=dtype)
+    # memory map the part files instead of reading them into buffers first
+    return pq.read_table(path, columns=columns, memory_map=True).to_pandas()
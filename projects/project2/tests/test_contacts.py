@@ -0,0 +1,40 @@
+"""
+Matching message handles to contacts through numbers that are written differently (contacts.same_number)
+
+Run from projects/project2: python3 -m pytest tests
+"""
+
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from contacts import normalize_phone_numbers, build_contact_index, resolve_handles, same_number
+
+
+def test_same_number_without_country_or_area_code():
+    assert same_number("+442079460018", "02079460018")
+    assert same_number("+14155550101", "4155550101")
+    assert same_number("+14155550101", "5550101")
+
+
+def test_full_numbers_that_differ_never_match():
+    # the same local number in another area code is someone else
+    assert not same_number("+14155550101", "+12155550101")
+    assert not same_number("+19155550101", "+12155550101")
+    assert not same_number("+14155550101", "+14155550102")
+    # too short to say anything
+    assert not same_number("+14155550101", "550101")
+
+
+def test_resolve_handles_only_credits_the_same_number():
+    numbers = pd.DataFrame({"name": ["Alex Kim", "Sam Chen"], "ZFULLNUMBER": ["(215) 555-0101", "020 7946 0018"]})
+    numbers["phone_number"] = normalize_phone_numbers(numbers["ZFULLNUMBER"])
+    numbers["last_four"] = numbers["phone_number"].str[-4:]
+    index = build_contact_index(numbers)
+
+    handles = pd.Series(["+12155550101", "+14155550101", "+19155550101", "+442079460018", "+12155550199"])
+    names = resolve_handles(handles, index, report=False)
+    assert names.fillna("").tolist() == ["Alex Kim", "", "", "Sam Chen", ""]
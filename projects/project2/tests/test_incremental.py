@@ -0,0 +1,140 @@
+"""
+An incremental run (get_parse_data.py --incremental then prepare_data.py --incremental) after new messages
+arrive (or the contacts change) gives the same outputs as a full run over the whole archive
+
+Run from projects/project2: python3 -m pytest tests
+"""
+
+import os
+import sys
+import shutil
+import sqlite3
+
+import pytest
+import pandas as pd
+
+project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_dir)
+sys.path.insert(0, os.path.join(project_dir, "benchmarks"))
+
+import utils
+import get_parse_data
+import prepare_data
+
+from synthetic_data import make_archive
+from storage import read_table
+from cube import load_cube
+
+n_messages = 3000
+first_part = 2400 # messages in chat.db before the rest arrive
+chunk_size = 500 # small chunks so the tables are appended to more than once per run
+outputs = ["text_counts.json", "text_counts_no_common_words.json", "spotify_linked.csv", "youtube_linked.csv",
+           "websites_linked.csv"]
+
+
+@pytest.fixture(autouse=True)
+def offline_stop_words(monkeypatch):
+    # a fixed list instead of the nltk corpus, so the tests don't need it downloaded
+    monkeypatch.setattr(utils, "load_library_stop_words", lambda: ["the", "and", "you", "to", "i", "it", "s"])
+    monkeypatch.setattr(utils, "_stop_words", None)
+
+
+def run(chat_db, contacts_db, incremental):
+    get_parse_data.main(chat_db=chat_db, contacts_db=contacts_db, incremental=incremental, chunk_size=chunk_size)
+    prepare_data.main(incremental=incremental)
+
+
+def read_output(name):
+    with open(os.path.join("data", name), encoding="utf-8") as f:
+        if name.endswith(".csv"):
+            # the links are listed in the order of the messages table, which is different after an append
+            return sorted(f.read().splitlines())
+        return f.read()
+
+
+def test_incremental_matches_full_run(tmp_path, monkeypatch):
+    chat_db, contacts_db = make_archive(str(tmp_path / "archive"), n_messages, n_contacts=40)
+
+    # the full run over every message
+    monkeypatch.chdir(tmp_path / "archive")
+    os.makedirs("data")
+    run(chat_db, contacts_db, incremental=False)
+    full_messages = read_table("messages")
+    full_cube, full_message_id = load_cube()
+    full_outputs = {name: read_output(name) for name in outputs}
+
+    # an incremental run over the first messages, then again after the rest were added to chat.db
+    partial_db = str(tmp_path / "chat.db")
+    shutil.copy(chat_db, partial_db)
+    conn = sqlite3.connect(partial_db)
+    conn.execute("delete from message where ROWID > ?", (first_part,))
+    conn.execute("delete from chat_message_join where message_id > ?", (first_part,))
+    conn.commit()
+
+    os.makedirs(tmp_path / "incremental" / "data")
+    monkeypatch.chdir(tmp_path / "incremental")
+    run(partial_db, contacts_db, incremental=True)
+    assert get_parse_data.load_ingest_state()["last_rowid"] == first_part
+
+    conn.execute("attach database ? as archive", (chat_db,))
+    conn.execute("insert into message select * from archive.message where ROWID > ?", (first_part,))
+    conn.execute("insert into chat_message_join select * from archive.chat_message_join where message_id > ?",
+                 (first_part,))
+    conn.commit()
+    conn.close()
+    run(partial_db, contacts_db, incremental=True)
+    assert get_parse_data.load_ingest_state()["last_rowid"] == n_messages
+
+    # messages are read newest first, so the appended ones come after the rest instead of before
+    by_id = ["message_id", "chat_id"]
+    messages = read_table("messages").sort_values(by_id, ignore_index=True)
+    pd.testing.assert_frame_equal(messages, full_messages.sort_values(by_id, ignore_index=True))
+
+    cube, last_message_id = load_cube()
+    assert last_message_id == full_message_id
+    assert cube.keys() == full_cube.keys()
+    for cell_key, cell in cube.items():
+        full_cell = full_cube[cell_key]
+        assert cell["count"] == full_cell["count"]
+        assert dict(cell["words"]) == dict(full_cell["words"])
+        assert dict(cell["emoji"]) == dict(full_cell["emoji"])
+
+    for name in outputs:
+        assert read_output(name) == full_outputs[name], name
+
+
+def add_contact(contacts_db, chat_db, first_name):
+    """
+    Add a contact to the address book for one of the numbers in chat.db that isn't a contact yet
+    """
+    known = set(read_table("contacts")["phone_number"])
+    conn = sqlite3.connect(chat_db)
+    handles = [handle for handle, in conn.execute("select id from handle order by ROWID")]
+    conn.close()
+    number = next(handle for handle in handles if handle.startswith("+1") and handle not in known)
+
+    conn = sqlite3.connect(contacts_db)
+    pk = conn.execute("select max(Z_PK) from ZABCDRECORD").fetchone()[0] + 1
+    conn.execute("insert into ZABCDRECORD values (?, ?, null)", (pk, first_name))
+    conn.execute("insert into ZABCDPHONENUMBER values (?, ?, ?, ?)", (pk, pk, number, number[-4:]))
+    conn.commit()
+    conn.close()
+
+
+def test_incremental_after_contacts_change(tmp_path, monkeypatch):
+    chat_db, contacts_db = make_archive(str(tmp_path / "archive"), n_messages, n_contacts=40)
+
+    os.makedirs(tmp_path / "incremental" / "data")
+    monkeypatch.chdir(tmp_path / "incremental")
+    run(chat_db, contacts_db, incremental=True)
+    # no new messages, but their texts now count for a new contact
+    add_contact(contacts_db, chat_db, "Robin")
+    run(chat_db, contacts_db, incremental=True)
+    incremental_outputs = {name: read_output(name) for name in outputs}
+    assert '"name":"Robin"' in incremental_outputs["text_counts.json"]
+
+    os.makedirs(tmp_path / "full" / "data")
+    monkeypatch.chdir(tmp_path / "full")
+    run(chat_db, contacts_db, incremental=False)
+    for name in outputs:
+        assert incremental_outputs[name] == read_output(name), name
@@ -0,0 +1,66 @@
+"""
+What goes into the pipeline stage keys (pipeline.py): every script a stage runs, and the stop words
+
+Run from projects/project2: python3 -m pytest tests
+"""
+
+import os
+import ast
+import sys
+import json
+
+project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_dir)
+
+import pipeline
+
+stage_scripts = {"extract": "get_parse_data", "prepare": "prepare_data", "spotify": "spotify_data",
+                 "youtube": "youtube_data"}
+
+
+def local_imports(module, seen=None):
+    """
+    The project modules a module imports, directly or through other project modules (including itself)
+    """
+    seen = set() if seen is None else seen
+    seen.add(module)
+    with open(os.path.join(project_dir, module + ".py")) as f:
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            name = name.split(".")[0]
+            if name not in seen and os.path.exists(os.path.join(project_dir, name + ".py")):
+                local_imports(name, seen)
+    return seen
+
+
+def test_stage_keys_cover_every_script_they_run(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for stage in pipeline.make_stages("chat.db", "AddressBook-v22.abcddb"):
+        scripts = set(stage["inputs"]()["scripts"])
+        expected = {module + ".py" for module in local_imports(stage_scripts[stage["name"]])}
+        assert expected <= scripts, (stage["name"], expected - scripts)
+
+
+def test_stop_words_hash_without_importing_the_libraries(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    imported = {library for library in ["nltk", "spacy"] if library in sys.modules}
+    versions = pipeline.stop_words_hash()
+    assert set(versions) == {"nltk", "spacy"}
+    assert {library for library in ["nltk", "spacy"] if library in sys.modules} == imported
+
+    # once the lists are saved, they're what the key depends on
+    os.makedirs("data")
+    with open("data/stop_words.json", "w") as f:
+        json.dump(["the", "and"], f)
+    saved = pipeline.stop_words_hash()
+    pipeline.fingerprints.clear()
+    with open("data/stop_words.json", "w") as f:
+        json.dump(["the", "and", "you"], f)
+    assert pipeline.stop_words_hash() != saved
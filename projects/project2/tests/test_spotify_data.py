@@ -0,0 +1,100 @@
+"""
+Looking up track artists in batches through the cache, with a fake spotipy client instead of the API
+
+Run from projects/project2: python3 -m pytest tests
+"""
+
+import os
+import sys
+
+import pandas as pd
+import spotipy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import spotify_data
+
+from spotify_data import resolve_track_artists, max_ids_per_request
+
+
+def track_id(i):
+    return f"{i:022d}"
+
+
+class FakeAuthManager:
+    def __init__(self):
+        self.token_requests = 0
+
+    def get_access_token(self, as_dict=True):
+        self.token_requests += 1
+        return "token"
+
+
+class FakeSpotify:
+    """
+    Answers sp.tracks/sp.track like spotify: known tracks have the artist "artist <id>", unknown ones are None,
+    rejected IDs make spotify turn down the whole request (HTTP 400) and with down set every request fails (502)
+    """
+
+    def __init__(self, known, rejected=(), down=False):
+        self.known, self.rejected, self.down = set(known), set(rejected), down
+        self.auth_manager = FakeAuthManager()
+        self.batches = []
+
+    def check(self, track_ids):
+        if self.down:
+            raise spotipy.SpotifyException(502, -1, "bad gateway")
+        if self.rejected.intersection(track_ids):
+            raise spotipy.SpotifyException(400, -1, "invalid id")
+
+    def track_info(self, track_id):
+        return {"artists": [{"name": f"artist {track_id}"}]} if track_id in self.known else None
+
+    def tracks(self, track_ids):
+        self.batches.append(list(track_ids))
+        self.check(track_ids)
+        return {"tracks": [self.track_info(track_id) for track_id in track_ids]}
+
+    def track(self, track_id):
+        self.batches.append([track_id])
+        self.check([track_id])
+        return self.track_info(track_id)
+
+
+def test_tracks_are_looked_up_in_batches_once():
+    track_ids = [track_id(i) for i in range(120)]
+    sp = FakeSpotify(known=track_ids[:100])
+    cache = resolve_track_artists(sp, track_ids + track_ids[:10] + ["not-a-spotify-id", None], {}, max_workers=2)
+    assert cache[track_id(5)] == [f"artist {track_id(5)}"]
+    # unknown and invalid IDs are cached as None so they aren't asked for again
+    assert cache[track_id(110)] is None and cache["not-a-spotify-id"] is None
+    assert sorted(len(batch) for batch in sp.batches) == [20, max_ids_per_request, max_ids_per_request]
+    assert sp.auth_manager.token_requests == 1
+
+    resolve_track_artists(sp, track_ids + [track_id(200)], cache)
+    assert sp.batches[-1] == [track_id(200)]
+
+
+def test_a_rejected_id_only_loses_its_own_track():
+    track_ids = [track_id(i) for i in range(10)]
+    sp = FakeSpotify(known=track_ids, rejected=[track_ids[3]])
+    cache = resolve_track_artists(sp, track_ids, {})
+    assert cache[track_ids[3]] is None
+    assert all(cache[t] == [f"artist {t}"] for t in track_ids if t != track_ids[3])
+
+
+def test_failed_requests_are_not_cached():
+    sp = FakeSpotify(known=[track_id(1)], down=True)
+    assert resolve_track_artists(sp, [track_id(1), track_id(2)], {}) == {}
+
+
+def test_main_counts_artists_of_linked_tracks(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("data")
+    links = [f"https://open.spotify.com/track/{track_id(i)}?si=1" for i in [1, 2, 1]]
+    pd.DataFrame({"text": links + ["https://open.spotify.com/playlist/abc"]}).to_csv("data/spotify_linked.csv")
+    spotify_data.main(sp=FakeSpotify(known=[track_id(1), track_id(2)]))
+    artists = pd.read_csv("data/spotify_artists.csv")
+    # the links are deduplicated before counting, so each track counts once
+    assert dict(zip(artists["artist"], artists["count"])) == {f"artist {track_id(1)}": 1, f"artist {track_id(2)}": 1}
+    assert os.path.exists(spotify_data.track_cache_path)
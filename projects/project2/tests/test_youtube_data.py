@@ -0,0 +1,83 @@
+"""
+Looking up video titles in batches through the cache, against a local stub of the YouTube videos endpoint
+
+Run from projects/project2: python3 -m pytest tests
+"""
+
+import os
+import sys
+import json
+import threading
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from youtube_data import resolve_video_titles, make_session, max_ids_per_request
+
+
+class VideosHandler(BaseHTTPRequestHandler):
+    """
+    Answers like the videos endpoint: every ID has the title "title <id>", except "gone..." IDs (deleted videos)
+    A batch with a "fail..." ID gets an error, the stub's requests lists the IDs of every request
+    """
+    requests = []
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        video_ids = query["id"][0].split(",")
+        self.requests.append(video_ids)
+        if query.get("key") != ["test-key"] or any(video_id.startswith("fail") for video_id in video_ids):
+            self.send_response(403)
+            self.end_headers()
+            return
+        items = [{"id": video_id, "snippet": {"title": f"title {video_id}"}}
+                 for video_id in video_ids if not video_id.startswith("gone")]
+        body = json.dumps({"items": items}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_url():
+    VideosHandler.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), VideosHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/youtube/v3/videos"
+    server.shutdown()
+    server.server_close()
+
+
+def test_titles_are_looked_up_in_batches_once(stub_url):
+    video_ids = [f"video{i}" for i in range(120)] + ["video0", "gone1", None]
+    cache = {}
+    with make_session() as session:
+        titles = resolve_video_titles(video_ids, cache, session, api_url=stub_url, api_key="test-key")
+    assert titles["video0"] == "title video0" and titles["video119"] == "title video119"
+    # deleted videos are cached as None so they aren't asked for again
+    assert titles["gone1"] is None and "gone1" in cache
+    assert [len(batch) for batch in VideosHandler.requests] == [max_ids_per_request, max_ids_per_request, 21]
+
+    # a second run only asks for the new IDs
+    with make_session() as session:
+        resolve_video_titles(video_ids + ["video200"], cache, session, api_url=stub_url, api_key="test-key")
+    assert VideosHandler.requests[-1] == ["video200"]
+    assert len(VideosHandler.requests) == 4
+
+
+def test_failed_batches_are_not_cached(stub_url):
+    cache = {}
+    with make_session() as session:
+        titles = resolve_video_titles(["video1", "fail2"], cache, session, api_url=stub_url, api_key="test-key")
+    assert titles == {"video1": None, "fail2": None}
+    assert cache == {}
@@ -3,14 +3,20 @@ Utility functions for natural language processing
 (Used to get most common words/emojis in texts)
 """
 
+import os
 import re
-import spacy
+import json
+import time
+
+_import_start = time.perf_counter()
+
+import pandas as pd
 
 from collections import Counter
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
 
-nlp = spacy.load("en_core_web_sm")
+from heavy_hitters import top_counts
+from interning import TextInterner, occurrences, weighted_counter
+
 imsg_reaction_words = ["loved", "liked", "disliked", "laughed", "emphasized", "questioned", "reacted"]
 other_stop_words = ["im", "u", "ill", "na", "ur"] # random stop words I noticed appeared a lot and didn't get filtered out
 
@@ -18,51 +24,164 @@ other_stop_words = ["im", "u", "ill", "na", "ur"] # random stop words I noticed
 # wanted to see how the data looked without them
 other_common_words = ["like", "lol", "lmao", "okay", "oh", "ok", "okie", "yes", "yeah", "yea", "good", "bc", "omg",
                         "hi", "haha", "hello", "uh", "ah", "id", "ive", "thats", "gon", "wan", "got", "tho", "said"]
-STOP_WORDS = set(stopwords.words('english') + 
-                 list(nlp.Defaults.stop_words) + 
-                 imsg_reaction_words +
-                 other_stop_words)
 
-# return most common words in a group of texts
-def most_common_words(texts, get_all=False, remove_common_words=False):
-    all_text = ' '.join(texts).lower().replace("'", ' ')
-    cleaned_text = re.sub(r'[^\w\s]', '', all_text)
+# the nltk + spacy stop words saved from a previous run, so neither library has to be imported
+stop_words_cache_path = "data/stop_words.json"
+_stop_words = None
+_nlp = None
+
+def load_library_stop_words():
+    """
+    The nltk and spacy english stop word lists
+    spacy's list is read straight from spacy.lang.en, loading en_core_web_sm just for it is slow
+    """
+    from nltk.corpus import stopwords
+    from spacy.lang.en.stop_words import STOP_WORDS as spacy_stop_words
+    return stopwords.words('english') + list(spacy_stop_words)
+
+def save_stop_words(cache_path=stop_words_cache_path):
+    with open(cache_path, "w") as f:
+        json.dump(sorted(set(load_library_stop_words())), f)
+
+def get_stop_words():
+    """
+    The combined stop words, built the first time they're needed
+    (the library lists are read from stop_words_cache_path if they have been saved with save_stop_words)
+    """
+    global _stop_words
+    if _stop_words is None:
+        if os.path.exists(stop_words_cache_path):
+            with open(stop_words_cache_path) as f:
+                library_stop_words = json.load(f)
+        else:
+            library_stop_words = load_library_stop_words()
+        _stop_words = frozenset(library_stop_words + 
+                                imsg_reaction_words +
+                                other_stop_words)
+    return _stop_words
+
+def get_nlp():
+    """
+    The full spacy pipeline, only loaded for features that actually need it
+    """
+    global _nlp
+    if _nlp is None:
+        import spacy
+        _nlp = spacy.load("en_core_web_sm")
+    return _nlp
+
+def __getattr__(name):
+    # utils.STOP_WORDS and utils.nlp still work, but are only loaded when first used
+    if name == "STOP_WORDS":
+        return get_stop_words()
+    if name == "nlp":
+        return get_nlp()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+emoji_pattern = re.compile(
+    "["
+    "\U0001F600-\U0001F64F"  # emoticons
+    "\U0001F300-\U0001F5FF"  # symbols & pictographs
+    "\U0001F680-\U0001F6FF"  # transport & map symbols
+    "\U0001F1E0-\U0001F1FF"  # flags (iOS)
+    "\U00002700-\U000027BF"  # Dingbats
+    "\U0001F900-\U0001F9FF"  # Supplemental Symbols and Pictographs
+    "\U00002600-\U000026FF"  # Misc symbols
+    "]", flags=re.UNICODE)  # Removed '+' to match single emoji characters
+
+punctuation_pattern = re.compile(r'[^\w\s]')
+
+# once punctuation is stripped, the only thing nltk's word_tokenize still does is split these
+# contractions (e.g. gonna -> gon na), so do the same here instead of running its tokenizer
+contractions = {"cannot": " can not ", "gimme": " gim me ", "gonna": " gon na ",
+                "gotta": " got ta ", "lemme": " lem me ", "wanna": " wan na "}
+contraction_pattern = re.compile(r"\b(?:" + "|".join(contractions) + r")\b")
+
+# lowercase and strip punctuation from a text (or many texts joined together)
+def clean_text(text):
+    cleaned_text = punctuation_pattern.sub('', text.lower().replace("'", ' '))
+    return contraction_pattern.sub(lambda match: contractions[match.group()], cleaned_text)
+
+# lowercase, strip punctuation and split a text (or joined texts) into word tokens
+def tokenize_text(text):
+    return clean_text(text).split()
+
+# same as tokenize_text for every text in a column, returns a series of token lists
+def tokenize_texts(texts):
+    texts = pd.Series(texts, dtype=object)
+    # clean all the texts in one go as a single newline separated string
+    # (newlines inside a text are just whitespace to the tokenizer)
+    joined_text = '\n'.join(texts.str.replace('\n', ' ', regex=False))
+    cleaned_texts = clean_text(joined_text).split('\n') if len(texts) else []
+    return pd.Series(cleaned_texts, index=texts.index, dtype=object).str.split()
+
+# tokens/emoji of each text that gets sent over and over are only worked out once (and cached), see interning.py
+text_interner = TextInterner({"words": lambda texts: tokenize_texts(texts).tolist(),
+                              "emoji": lambda texts: [emoji_pattern.findall(text) for text in texts]})
 
-    stop_words = STOP_WORDS
+# counter of the tokens/emoji ("words"/"emoji") in a group of texts
+# every distinct text is analyzed once (or found in the cache), weighted by the times it was sent
+def count_interned(texts, name):
+    codes, uniques = text_interner.intern(texts)
+    counts = occurrences(codes, len(uniques))
+    return weighted_counter(counts, text_interner.analyze(uniques, name, counts))
+
+# count words in a group of texts
+def count_words(texts):
+    return count_interned(texts, "words")
+
+# approximate word counts in a fixed amount of memory, only the capacity most frequent words are kept
+# (see heavy_hitters.py for the error bounds), words top_words would skip are dropped from each chunk first
+# so they don't take up the capacity (or add to the error)
+def count_words_approx(texts, capacity=1000, chunk_size=10000, remove_common_words=False):
+    texts = list(texts)
+    skipped = skipped_words(remove_common_words)
+    chunks = (kept_words(count_words(texts[i:i + chunk_size]), skipped) for i in range(0, len(texts), chunk_size))
+    return top_counts(chunks, capacity).counter()
+
+# count emoji in a group of texts
+def count_emoji(texts):
+    return count_interned(texts, "emoji")
+
+# the words left out of the top words: stop words (and the other common words with remove_common_words)
+def skipped_words(remove_common_words=False):
+    stop_words = get_stop_words()
     if remove_common_words:
         stop_words = stop_words.union(other_common_words)
+    return stop_words
 
-    word_tokens = word_tokenize(cleaned_text)
-    words = [w for w in word_tokens if w not in stop_words and len(w.strip()) > 1]
+# the counts of the words in a word counter that aren't skipped or a single character
+def kept_words(word_counts, skipped):
+    return Counter({w: c for w, c in word_counts.items() if w not in skipped and len(w.strip()) > 1})
 
+# return the top n words from a word counter, skipping stop words
+def top_words(word_counts, n=15, remove_common_words=False):
+    words = kept_words(word_counts, skipped_words(remove_common_words))
     if not words:
         return None
-    c = Counter(words)
-    top_10 = c.most_common(15)
+    return words.most_common(n)
 
+# return the single most common emoji from an emoji counter
+def top_emoji(emoji_counts):
+    if not emoji_counts:
+        return None
+    return emoji_counts.most_common(1)[0]
+
+# return most common words in a group of texts
+# with capacity the words are counted approximately, keeping only that many distinct words in memory
+def most_common_words(texts, get_all=False, remove_common_words=False, capacity=None):
+    if capacity is None:
+        word_counts = count_words(texts)
+    else:
+        word_counts = count_words_approx(texts, capacity, remove_common_words=remove_common_words)
     if not get_all:
-        return top_10 
+        return top_words(word_counts, remove_common_words=remove_common_words)
     else:
-        return c.most_common(100) # still just do 100 for brevity
+        return top_words(word_counts, n=100, remove_common_words=remove_common_words) # still just do 100 for brevity
 
 # return most common emoji in a group of texts
 def most_common_emoji(texts):
-    emoji_pattern = re.compile(
-        "["
-        "\U0001F600-\U0001F64F"  # emoticons
-        "\U0001F300-\U0001F5FF"  # symbols & pictographs
-        "\U0001F680-\U0001F6FF"  # transport & map symbols
-        "\U0001F1E0-\U0001F1FF"  # flags (iOS)
-        "\U00002700-\U000027BF"  # Dingbats
-        "\U0001F900-\U0001F9FF"  # Supplemental Symbols and Pictographs
-        "\U00002600-\U000026FF"  # Misc symbols
-        "]", flags=re.UNICODE)  # Removed '+' to match single emoji characters
-    emojis = []
-    for text in texts:
-        emojis.extend(emoji_pattern.findall(text))
-    if not emojis:
-        return None
-    return Counter(emojis).most_common(1)[0]
+    return top_emoji(count_emoji(texts))
 
 # gets most common words and emoji for a grouped dataframe
 def print_group_stats(grouped_df, group_name):
@@ -73,3 +192,33 @@ def print_group_stats(grouped_df, group_name):
         common_word = most_common_words(texts)
         common_emoji = most_common_emoji(texts)
         print(f"{group_name} {group_keys}: count={count}, most_common_words={common_word}, most_common_emoji={common_emoji}")
+
+# same as print_group_stats, but from counters that have already been built (e.g. by parallel.py)
+def print_counter_stats(groups, group_name):
+    print(f"\nStatistics for texts grouped by {group_name}:")
+    for group_keys, group in sorted(groups.items()):
+        if len(group_keys) == 1:
+            group_keys = group_keys[0]
+        count = group["count"]
+        common_word = top_words(group["words"])
+        common_emoji = top_emoji(group["emoji"])
+        print(f"{group_name} {group_keys}: count={count}, most_common_words={common_word}, most_common_emoji={common_emoji}")
+
+import_time = time.perf_counter() - _import_start
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Report how long the NLP helpers take to start up")
+    parser.add_argument("--save-stop-words", action="store_true",
+                        help=f"save the nltk/spacy stop words to {stop_words_cache_path} for faster startup")
+    args = parser.parse_args()
+
+    if args.save_stop_words:
+        save_stop_words()
+        print(f"Saved stop words to {stop_words_cache_path}")
+
+    print(f"utils imported in {import_time * 1000:.1f} ms")
+    start = time.perf_counter()
+    stop_words = get_stop_words()
+    source = stop_words_cache_path if os.path.exists(stop_words_cache_path) else "nltk + spacy.lang.en"
+    print(f"{len(stop_words)} stop words loaded from {source} in {(time.perf_counter() - start) * 1000:.1f} ms")
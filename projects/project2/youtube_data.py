@@ -3,15 +3,25 @@ Given a list of Youtube links, queries the Youtube API to get video titles
 Finds and saves common words in those video titles
 """
 
+import os
+import json
+import argparse
 import pandas as pd
 
 import requests
 from tqdm import tqdm
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from urllib.parse import urlparse, parse_qs
 
-from config import YOUTUBE_API_KEY
 from utils import most_common_words
 
+YOUTUBE_API_URL = "https://www.googleapis.com/youtube/v3/videos"
+max_ids_per_request = 50 # the videos endpoint accepts up to 50 comma separated IDs
+
+# video ID -> title from previous runs, so re-runs only look up new videos
+title_cache_path = "data/youtube_title_cache.json"
+
 def extract_video_id(url):
     """
     Extract the YouTube video ID from various URL formats.
@@ -42,37 +52,97 @@ def extract_video_id(url):
 
     return None
 
-def get_video_title(video_id):
+def make_session(pool_size=10):
     """
-    Query the YouTube Data API to get the video title for a given video ID.
+    requests session that reuses connections and retries on rate limits/server errors
     """
-    if not video_id:
+    session = requests.Session()
+    retries = Retry(total=5, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retries)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def load_title_cache(cache_path=title_cache_path):
+    """
+    Load the saved video ID -> title mapping (a None title means the video wasn't found)
+    """
+    if not os.path.exists(cache_path):
+        return {}
+    with open(cache_path) as f:
+        return json.load(f)
+
+def save_title_cache(cache, cache_path=title_cache_path):
+    with open(cache_path, "w") as f:
+        json.dump(cache, f)
+
+def fetch_video_titles(video_ids, session, api_url=YOUTUBE_API_URL, api_key=None):
+    """
+    Query the YouTube Data API for up to 50 video IDs in one request
+    Returns {video_id: title}, with None for videos that don't exist (deleted, private, bad ID)
+    Returns None if the request itself failed, so nothing gets cached
+    The API key is read from config.py when api_key isn't given
+    """
+    if api_key is None:
+        from config import YOUTUBE_API_KEY as api_key
+    params = {"part": "snippet", "id": ",".join(video_ids), "maxResults": max_ids_per_request, "key": api_key}
+    try:
+        response = session.get(api_url, params=params)
+    except requests.RequestException:
         return None
-    api_url = f"https://www.googleapis.com/youtube/v3/videos?part=snippet&id={video_id}&key={YOUTUBE_API_KEY}"
-    response = requests.get(api_url)
     if response.status_code != 200:
         return None
     data = response.json()
-    items = data.get("items", [])
-    if not items:
+    titles = dict.fromkeys(video_ids)
+    for item in data.get("items", []):
+        titles[item["id"]] = item["snippet"]["title"]
+    return titles
+
+def resolve_video_titles(video_ids, cache, session, api_url=YOUTUBE_API_URL, api_key=None):
+    """
+    Get titles for the given video IDs, only querying the API for (deduplicated) IDs not in the cache
+    New results are added to the cache
+    """
+    missing = [video_id for video_id in dict.fromkeys(video_ids) if video_id and video_id not in cache]
+    print(f"{len(missing)} video IDs to look up ({len(cache)} cached)")
+    for i in tqdm(range(0, len(missing), max_ids_per_request)):
+        batch = missing[i:i + max_ids_per_request]
+        titles = fetch_video_titles(batch, session, api_url=api_url, api_key=api_key)
+        if titles is None:
+            print(f"Error fetching titles for {len(batch)} videos, will retry them next run")
+            continue
+        cache.update(titles)
+    return {video_id: cache.get(video_id) for video_id in video_ids if video_id}
+
+def get_video_title(video_id, session=None):
+    """
+    Query the YouTube Data API to get the video title for a given video ID.
+    """
+    if not video_id:
+        return None
+    titles = fetch_video_titles([video_id], session or make_session())
+    if not titles:
         return None
-    return items[0]["snippet"]["title"]
+    return titles[video_id]
 
-def get_video_titles_from_csv(csv_path):
+def get_video_titles_from_csv(csv_path, cache_path=title_cache_path, api_url=YOUTUBE_API_URL, api_key=None):
     df = pd.read_csv(csv_path)
-    titles = []
-    for url in tqdm(df["text"]):
-        # Extract video ID
-        video_id = extract_video_id(url)
-        if video_id:
-            title = get_video_title(video_id)
-            if title:
-                titles.append((url, title))
-    return titles
+    # Extract video IDs
+    video_ids = [extract_video_id(url) for url in df["text"]]
 
-if __name__ == "__main__":
+    cache = load_title_cache(cache_path)
+    with make_session() as session:
+        try:
+            titles = resolve_video_titles(video_ids, cache, session, api_url=api_url, api_key=api_key)
+        finally:
+            save_title_cache(cache, cache_path)
+
+    return [(url, titles[video_id]) for url, video_id in zip(df["text"], video_ids)
+            if video_id and titles[video_id]]
+
+def main(cache_path=title_cache_path, api_url=YOUTUBE_API_URL):
     csv_path = "./data/youtube_linked.csv"
-    titles = get_video_titles_from_csv(csv_path)
+    titles = get_video_titles_from_csv(csv_path, cache_path=cache_path, api_url=api_url)
     matched_titles = []
     for url, title in titles:
         print(f"{url} -> {title}")
@@ -85,3 +155,10 @@ if __name__ == "__main__":
     df = pd.DataFrame(common_title_words, columns=['word', 'count'])
 
     df.to_csv("data/youtube_title_counts.csv", columns=['word', 'count'], index=False)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Look up the titles of linked youtube videos")
+    parser.add_argument("--api-url", default=YOUTUBE_API_URL, help="videos endpoint to query (e.g. a local stub server)")
+    parser.add_argument("--cache", default=title_cache_path, help="JSON file of video ID -> title results from previous runs")
+    args = parser.parse_args()
+    main(cache_path=args.cache, api_url=args.api_url)